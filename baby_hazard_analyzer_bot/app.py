@@ -1,43 +1,17 @@
 import streamlit as st
-import cv2
-import tempfile
-from PIL import Image
-from PIL import ImageOps
-import numpy as np
 import os
 import requests
-import json
-import re
-from image_analyzer import analyze_image
-from stqdm import stqdm
-
-prompt = \
-"""You are helping parents identify potential hazards in a room where young children (under 5 years old) may play.
-
-From the uploaded image, identify only realistic and significant safety risks, such as:
-
-- Items that could cause strangulation (e.g., cords, strings) or suffocation (e.g., plastic bags, pillows)
-- Sharp edges at child height
-- Exposed electrical outlets
-- Open drawers or cabinets and unstable furniture
-- Small choking hazards on the floor
-- Bottles containing liquids on the floor
-- Heavy or hot objects within child reach
-- Dangerous items within reach (e.g., knives, scissors)
-
-Output a json list where each entry contains the 2D bounding box as [ymin, xmin, ymax, xmax] in "box_2d" and a text label in "label"."""
-
-def extract_json_from_string(text):
-    # Try to extract the first JSON-like object or array
-    match = re.search(r'(\{.*\}|\[.*\])', text, re.DOTALL)
-    if match:
-        try:
-            return json.loads(match.group(1))
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}. TEXT: {text}")
-    else:
-        print(f"No JSON found. TEXT: {text}")
-    return []
+import time
+import uuid
+from keyframes import FRAME_BUDGET
+from preprocess import MAX_LONG_SIDE, QUALITY
+from jobs import DONE, FAILED, QUEUED, can_retry, get_job_runner, get_job_store, job_dir, upload_key
+from scratch import copy_upload, touch
+from metrics import start_metrics_server
+from pipeline import MAX_IN_FLIGHT, BATCH_SIZE
+from prefilter import get_detector
+
+POLL_SECONDS = 1  # How often the page refreshes a running job's progress
 
 def setup_page():
     """Configure page settings and styling."""
@@ -45,125 +19,234 @@ def setup_page():
     st.title("🛡️ SafeNest AI")
     st.write("Upload a room video to detect potential child safety hazards.")
 
-# Function to send image to Gemini API and get bounding boxes
-def get_bounding_boxes_from_gemini(image: Image.Image) -> list:
-    global prompt
-    # """
-    # Sends the image to the Gemini API and retrieves bounding boxes.
-    # """
-    try:
-        response = analyze_image(image, prompt)
-        print(response)
-        boxes = extract_json_from_string(response)
-        print("\n Analyzed boxes: ", boxes)
-        return boxes
-    except Exception as e:
-        st.error(f"Error generating boxes: {e}")
-        return []
+@st.cache_resource
+def serve_metrics(port):
+    """Start the Prometheus /metrics endpoint once per process."""
+    return start_metrics_server(port)
+
+def show_run_metrics(run_metrics, seconds):
+    """
+    Show a run's per-stage time breakdown and token usage in the sidebar.
+
+    Args:
+        run_metrics (dict): Metrics recorded during the run (see metrics.diff)
+        seconds (float): Wall-clock duration of the run
+    """
+    if not run_metrics["stages"]:
+        return
+    with st.sidebar.expander("Stage timings"):
+        st.caption(f"Run took {seconds:.1f}s. Stage times are summed over parallel requests.")
+        rows = [
+            {"stage": name, "calls": stage["count"], "total (s)": round(stage["seconds"], 2),
+             "mean (ms)": round(stage["seconds"] / stage["count"] * 1000, 1)}
+            for name, stage in sorted(run_metrics["stages"].items(), key=lambda item: -item[1]["seconds"])
+        ]
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        tokens = run_metrics["tokens"]
+        if run_metrics["responses"]:
+            st.caption(f"Tokens: {tokens['prompt']} prompt, {tokens['output']} output, {tokens['cached']} cached "
+                       f"over {run_metrics['responses']} responses "
+                       f"({(tokens['prompt'] - tokens['cached']) / run_metrics['responses']:.0f} uncached prompt "
+                       f"tokens per response)")
+
+def show_hazards(placeholder, hazards):
+    """
+    Render the hazards found so far as a list.
+
+    Args:
+        placeholder: Streamlit placeholder to render into
+        hazards (dict): Label -> (index of the first keyframe it was seen in, number of keyframes it was seen in)
+    """
+    if not hazards:
+        placeholder.caption("No hazards found yet.")
+        return
+    lines = [f"- **{label}**: first seen in frame {first}, {count} keyframe{'s' if count > 1 else ''}"
+             for label, (first, count) in sorted(hazards.items(), key=lambda item: item[1][0])]
+    placeholder.markdown("\n".join(lines))
+
+def get_user_id():
+    """Return this browser's user ID, kept in the URL so it survives reconnects."""
+    if "user" not in st.query_params:
+        st.query_params["user"] = uuid.uuid4().hex
+    return st.query_params["user"]
+
+def submit_upload(uploaded_video, key, settings, user):
+    """
+    Store an upload in a new job directory and queue its analysis.
+
+    Args:
+        uploaded_video (UploadedFile): The uploaded video
+        key (str): upload_key of the upload and settings
+        settings (dict): Analysis settings (see jobs.run_job)
+        user (str): ID of the submitting user
+
+    Returns:
+        str: The job ID
+    """
+    runner = get_job_runner()
+    job_id = uuid.uuid4().hex
+    directory = job_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+    video_path = os.path.join(directory, "input.mp4")
+    copy_upload(uploaded_video, video_path)
+    return runner.submit(user, key, settings, video_path, os.path.join(directory, "annotated.mp4"), job_id)
+
+@st.fragment(run_every=POLL_SECONDS)
+def show_job_progress(job_id):
+    """Show a pending job's progress, latest annotated keyframe and hazards, refreshing until it finishes."""
+    store = get_job_store()
+    job = store.get(job_id)
+    if job["status"] in (DONE, FAILED):
+        # Leave the polling fragment and render the result once
+        st.rerun()
+    if job["status"] == QUEUED:
+        st.info(f"Waiting for a free worker ({store.queue_position(job_id)} jobs ahead). "
+                "You can close this page and come back to this URL later.")
+        return
+    st.info(f"Analyzing keyframes: {job['progress']} done so far.")
+    if job["preview_path"] and os.path.exists(job["preview_path"]):
+        st.image(job["preview_path"], caption="Latest keyframe", use_container_width=True)
+    show_hazards(st.empty(), job["hazards"])
+
+def show_rescan(rescan):
+    """Show how a re-scan compares with the room's previous scan."""
+    if rescan["baseline_time"] is None:
+        st.info("First scan of this room: it will be the baseline for the next one.")
+        return
+    scanned = time.strftime("%Y-%m-%d %H:%M", time.localtime(rescan["baseline_time"]))
+    st.info(f"Compared with the scan from {scanned}: {rescan['carried_over']} unchanged keyframes were carried over, "
+            f"{rescan['analyzed']} were analyzed.")
+    diff = rescan["diff"]
+    lines = [f"- 🆕 **{label}**" for label in diff["new"]] + [f"- ✅ ~~{label}~~ (resolved)" for label in diff["resolved"]]
+    st.markdown("\n".join(lines) if lines else "No hazards appeared or disappeared since the last scan.")
+
+def show_job_result(job):
+    """Show a finished job: its errors, hazards, run statistics and the annotated video."""
+    for error in job["errors"]:
+        st.error(error)
+    if job["status"] == FAILED:
+        st.error(job["error"])
+        return
+    result = job["result"]
+    if not result["frames"]:
+        return
+    st.success(f"Analyzed {result['keyframes']} keyframes and annotated {result['frames']} frames.")
+    show_hazards(st.empty(), job["hazards"])
+    if result["rescan"]:
+        show_rescan(result["rescan"])
+    if result["requests"]:
+        st.sidebar.caption(f"Uploaded {result['bytes_uploaded'] / 1e6:.1f} MB: {result['frames_uploaded']} frames in "
+                           f"{result['requests']} requests "
+                           f"({result['bytes_uploaded'] / result['frames_uploaded'] / 1e3:.0f} KB/frame, "
+                           f"{result['requests'] / result['seconds']:.2f} requests/s)")
+    if result["prefilter"]:
+        st.sidebar.caption(f"CPU pre-filter: skipped {result['prefilter']['frames_skipped']} of "
+                           f"{result['prefilter']['frames_seen']} keyframes "
+                           f"({result['prefilter']['frames_saved']:.0%}), "
+                           f"{result['prefilter']['pixels_saved']:.0%} fewer pixels sent")
+
+    # Cache and limiter state of the worker process that ran the job
+    cache_stats = result["cache"]
+    st.sidebar.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                       f"({cache_stats['entries']} entries)")
+    context_stats = result["context_cache"]
+    st.sidebar.caption(f"Context cache: {context_stats['hits']} requests used the cached prompt, "
+                       f"{context_stats['inline']} sent it inline ({context_stats['hit_rate']:.0%} hit rate)")
+    limiter_stats = result["limiter"]
+    st.sidebar.caption(f"Rate limiter: {limiter_stats['rate']} requests/s, "
+                       f"{limiter_stats['concurrency']} concurrent, {limiter_stats['retries']} retries "
+                       f"({limiter_stats['rate_limited']} rate limited)")
+    show_run_metrics(result["metrics"], result["seconds"])
+
+    # Display the annotated video in Streamlit
+    if not os.path.exists(job["output_path"]):
+        st.warning("The annotated video was removed to free disk space. Upload the video again and choose "
+                   "\"Analyze again\" to re-analyze it.")
+        return
+    touch(job["output_path"])
+    st.video(job["output_path"])
+
+def show_recent_jobs(user, current_job_id):
+    """List the user's recent jobs in the sidebar, with a button to reopen each."""
+    jobs = [job for job in get_job_store().jobs_for(user) if job["id"] != current_job_id]
+    if not jobs:
+        return
+    with st.sidebar.expander("Your recent jobs"):
+        for job in jobs:
+            label = f"{job['id'][:8]}: {job['status']}, {job['progress']} keyframes"
+            if st.button(label, key=f"job-{job['id']}"):
+                st.query_params["job"] = job["id"]
+                st.rerun()
 
 def main():
     """Main application function."""
     setup_page()
+    # Start the worker pool on the first page load, not on the first upload, so jobs requeued
+    # after a restart run (and the scratch sweep happens) even if nobody uploads
+    get_job_runner()
+    if os.getenv("METRICS_PORT"):
+        serve_metrics(int(os.getenv("METRICS_PORT")))
+    user = get_user_id()
+
+    max_in_flight = st.sidebar.slider("Parallel requests", min_value=1, max_value=32, value=MAX_IN_FLIGHT,
+                                      help="Maximum number of frames analyzed at the same time.")
+    frame_budget = st.sidebar.slider("Frame budget", min_value=5, max_value=300, value=FRAME_BUDGET,
+                                     help="Maximum number of keyframes sent to the model per video.")
+    batch_size = st.sidebar.slider("Frames per request", min_value=1, max_value=8, value=BATCH_SIZE,
+                                   help="Send several frames in one request to share the prompt's fixed cost.")
+    track_boxes = st.sidebar.checkbox("Track boxes between keyframes", value=True,
+                                      help="Annotate every frame at the video's frame rate by tracking keyframe boxes.")
+    detector = get_detector()
+    use_prefilter = st.sidebar.checkbox("CPU pre-filter", value=detector is not None, disabled=detector is None,
+                                        help="Skip keyframes without objects near floor level and send only the region "
+                                             "around them, using a local detector (set PREFILTER_MODEL to enable).")
+    room = st.sidebar.text_input("Room", help="Name the room to compare with its previous scan and only analyze "
+                                              "what changed (e.g. \"nursery\"). Leave empty to analyze from scratch.")
+    with st.sidebar.expander("Upload settings"):
+        upload_settings = {
+            "max_long_side": st.select_slider("Max long side (px)", options=[512, 768, 1024, 1536, 2048], value=MAX_LONG_SIDE),
+            "image_format": st.radio("Format", ["JPEG", "WEBP"], horizontal=True),
+            "quality": st.slider("Quality", min_value=30, max_value=95, value=QUALITY),
+            "grayscale": st.checkbox("Grayscale"),
+        }
 
     # Video upload
     uploaded_video = st.file_uploader("Upload your room video", type=["mp4", "mov", "avi"])
 
     if uploaded_video:
-        # Create a temporary file to store the uploaded video
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video_file:
-            temp_video_file.write(uploaded_video.read())
-            temp_video_path = temp_video_file.name
-
         # Display the uploaded video
-        st.video(temp_video_path)
-
-        # Extract frames at 1 FPS
-        cap = cv2.VideoCapture(temp_video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        if fps == 0:
-            st.error("Could not retrieve FPS from the video.")
+        st.video(uploaded_video)
+
+        # Uploads with the same video and settings reattach to the latest job for them instead of
+        # queueing a new one (parallelism does not change the result, so it is not part of the key).
+        # This includes failed jobs, so their errors are shown; analyzing again is an explicit choice
+        settings = {
+            "frame_budget": frame_budget,
+            "batch_size": batch_size,
+            "track_boxes": track_boxes,
+            "upload": upload_settings,
+            "prefilter": use_prefilter,
+            "room": room.strip() or None,
+        }
+        key = upload_key(uploaded_video, settings)
+        job = get_job_store().find(key)
+        if job is None or (can_retry(job) and st.button("Analyze again")):
+            job_id = submit_upload(uploaded_video, key, {**settings, "max_in_flight": max_in_flight}, user)
         else:
-            frame_interval = int(fps)  # 1 frame per second
-
-            frames = []
-            frame_count = 0
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                if frame_count % frame_interval == 0:
-                    # Convert BGR to RGB
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    pil_image = Image.fromarray(frame_rgb)
-                    frames.append(pil_image)
-                frame_count += 1
-            cap.release()
-
-            st.success(f"Extracted {len(frames)} frames at 1 FPS.")
-
-            annotated_frames = []
-
-            for idx in stqdm(range(len(frames))):
-                frame = frames[idx]
-                # Get bounding boxes from Gemini API
-                boxes = get_bounding_boxes_from_gemini(frame)
-
-                # Convert PIL Image to OpenCV format
-                frame_cv = cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR)
-                # Rotate by 90 degrees clockwise
-                frame_cv = cv2.rotate(frame_cv, cv2.ROTATE_90_CLOCKWISE)
-
-                # Draw bounding boxes
-                for box in boxes:
-                    if 'box_2d' in box and len(box['box_2d']) == 4:
-                        ymin, xmin, ymax, xmax = box['box_2d']
-                        cv2.rectangle(frame_cv, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
-                        
-                        label = box['label']
-                        # Set font and scale
-                        font = cv2.FONT_HERSHEY_SIMPLEX
-                        font_scale = 0.6
-                        font_thickness = 2
-                        text_size, _ = cv2.getTextSize(label, font, font_scale, font_thickness)
-
-                        # Position for the label
-                        label_origin = (xmin, ymin - 10)
-
-                        cv2.putText(frame_cv, label, label_origin, font, font_scale, (0, 0, 0), font_thickness)
-
-                # Convert back to PIL Image for Streamlit
-                annotated_frame = Image.fromarray(cv2.cvtColor(frame_cv, cv2.COLOR_BGR2RGB))
-                annotated_frame = ImageOps.exif_transpose(annotated_frame)
-                annotated_frames.append(annotated_frame)
-
-            # Define video properties
-            frame_height, frame_width = annotated_frames[0].size[1], annotated_frames[0].size[0]
-            output_fps = 1  # 1 frame per second
-
-            # Create a temporary file to save the annotated video
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_output_video_file:
-                temp_output_video_path = temp_output_video_file.name
-
-            # Initialize VideoWriter
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            video_writer = cv2.VideoWriter(temp_output_video_path, fourcc, output_fps, (frame_width, frame_height))
-
-            # Write frames to the video
-            for frame in annotated_frames:
-                frame_cv = cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR)
-                video_writer.write(frame_cv)
-
-            video_writer.release()
-
-            os.system(f"ffmpeg -i {temp_output_video_path} -vcodec libx264 {temp_output_video_path}_out.mp4") 
-
-            # Display the annotated video in Streamlit
-            st.video(f"{temp_output_video_path}_out.mp4")
-
-            # Optionally, delete the temporary files after use
-            # os.unlink(temp_video_path)
-            # os.unlink(temp_output_video_path)
+            job_id = job["id"]
+        st.query_params["job"] = job_id
+    else:
+        # A returning user reattaches to the job in the URL
+        job_id = st.query_params.get("job")
+
+    show_recent_jobs(user, job_id)
+    job = get_job_store().get(job_id) if job_id else None
+    if job is None:
+        return
+    if job["status"] in (DONE, FAILED):
+        show_job_result(job)
+    else:
+        show_job_progress(job_id)
 
 if __name__ == "__main__":
-    main()
-
+    main()
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""
+Headless batch hazard analysis for many room videos.
+Videos are spread across a process pool, while a semaphore shared by all workers
+caps the number of Gemini requests in flight. For each video a JSONL file of box
+records (and optionally an annotated MP4) is written; videos whose outputs are
+already complete are skipped, so an interrupted run can simply be restarted.
+
+Example:
+    python batch_cli.py inspections/ "archive/*.mov" --output-dir results --video
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from keyframes import FRAME_BUDGET
+from metrics import METRICS, combine, diff
+from pipeline import process_video, quiet_streamlit, BATCH_SIZE, MAX_IN_FLIGHT
+from prefilter import MODEL_PATH, Prefilter, get_detector
+from preprocess import UploadPreprocessor, MAX_LONG_SIDE, QUALITY, IMAGE_FORMAT
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi")
+
+# Shared API semaphore, set in each worker process by _init_worker
+_api_limiter = None
+
+def _init_worker(api_limiter):
+    """Process pool initializer: keep the shared semaphore and quiet Streamlit's bare-mode warnings."""
+    global _api_limiter
+    _api_limiter = api_limiter
+    quiet_streamlit()
+
+def find_videos(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of video files.
+
+    Args:
+        inputs (list[str]): Video files, directories or glob patterns
+
+    Returns:
+        list[str]: Paths of the videos found
+    """
+    videos = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            paths = glob.glob(item)
+        videos.update(path for path in paths if path.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(path))
+    return sorted(videos)
+
+def output_paths(video_path, output_dir):
+    """
+    Return the (JSONL, MP4) output paths for a video.
+
+    Names are the video's name plus a short hash of its full path, so videos with
+    the same name in different directories (or with different extensions) never
+    share outputs.
+    """
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    path_hash = hashlib.sha256(os.path.realpath(video_path).encode("utf-8")).hexdigest()[:8]
+    name = f"{stem}-{path_hash}"
+    return os.path.join(output_dir, f"{name}.jsonl"), os.path.join(output_dir, f"{name}.mp4")
+
+def is_complete(video_path, output_dir, write_video):
+    """Return whether a video already has all of its outputs."""
+    jsonl_path, video_out_path = output_paths(video_path, output_dir)
+    return os.path.exists(jsonl_path) and (not write_video or os.path.exists(video_out_path))
+
+def analyze_video_file(video_path, output_dir, options):
+    """
+    Run the hazard pipeline on one video and write its outputs.
+
+    Outputs are written under temporary names and renamed once complete, so a
+    crash (or a video with failed requests) never leaves a file that looks finished.
+
+    Args:
+        video_path (str): Path to the video
+        output_dir (str): Directory for the outputs
+        options (dict): Keyword arguments for pipeline.process_video, plus "write_video",
+            "upload" (keyword arguments for UploadPreprocessor) and "prefilter_model"
+            (detector for the CPU pre-filter, or None)
+
+    Returns:
+        dict: Summary with the video path, keyframe and box counts, the elapsed time,
+        the video's per-stage metrics and the pre-filter's savings
+
+    Raises:
+        RuntimeError: If any request for the video failed
+    """
+    options = dict(options)
+    write_video = options.pop("write_video")
+    # Only track boxes through the in-between frames when they are written to a video
+    track_boxes = options.pop("track_boxes") and write_video
+    preprocessor = UploadPreprocessor(**options.pop("upload"))
+    prefilter_model = options.pop("prefilter_model")
+    prefilter = Prefilter(get_detector(prefilter_model)) if prefilter_model else None
+    jsonl_path, video_out_path = output_paths(video_path, output_dir)
+    jsonl_tmp = f"{jsonl_path}.part"
+    video_tmp = f"{video_out_path[:-4]}.part.mp4"
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 1
+    cap.release()
+
+    start_time = time.perf_counter()
+    metrics_before = METRICS.snapshot()
+    keyframes = boxes_written = 0
+    errors = []
+    with open(jsonl_tmp, "w") as jsonl_file:
+        frames = process_video(video_path, video_tmp if write_video else None, preprocessor=preprocessor,
+                               track_boxes=track_boxes, on_error=errors.append, api_limiter=_api_limiter,
+                               prefilter=prefilter, **options)
+        for frame, boxes in frames:
+            if not frame.keyframe:
+                continue
+            keyframes += 1
+            for box in boxes:
+                record = {
+                    "video": video_path,
+                    "frame_index": frame.index,
+                    "timestamp": round(frame.index / fps, 3),
+                    "label": box.get("label"),
+                    "box_2d": box["box_2d"],
+                }
+                jsonl_file.write(json.dumps(record) + "\n")
+                boxes_written += 1
+
+    # Leave the partial outputs behind so the video is retried on the next run
+    if errors:
+        raise RuntimeError(f"{len(errors)} failed requests, first: {errors[0]}")
+    if write_video:
+        os.replace(video_tmp, video_out_path)
+    os.replace(jsonl_tmp, jsonl_path)
+    return {
+        "video": video_path,
+        "keyframes": keyframes,
+        "boxes": boxes_written,
+        "seconds": round(time.perf_counter() - start_time, 1),
+        "metrics": diff(METRICS.snapshot(), metrics_before),
+        "prefilter": prefilter.stats() if prefilter else None,
+    }
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Detect child safety hazards in room videos without the web UI.")
+    parser.add_argument("inputs", nargs="+", help="Video files, directories or glob patterns")
+    parser.add_argument("--output-dir", required=True, help="Directory for the JSONL (and MP4) outputs")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Number of videos processed in parallel")
+    parser.add_argument("--api-concurrency", type=int, default=MAX_IN_FLIGHT,
+                        help="Maximum number of Gemini requests in flight across all processes")
+    parser.add_argument("--frame-budget", type=int, default=FRAME_BUDGET, help="Maximum keyframes per video")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Frames per Gemini request")
+    parser.add_argument("--max-long-side", type=int, default=MAX_LONG_SIDE, help="Longest side of uploaded frames")
+    parser.add_argument("--image-format", choices=["JPEG", "WEBP"], default=IMAGE_FORMAT)
+    parser.add_argument("--quality", type=int, default=QUALITY, help="Upload encoder quality (1-100)")
+    parser.add_argument("--prefilter-model", default=MODEL_PATH,
+                        help="ONNX detector (e.g. yolov8n.onnx) for the CPU pre-filter that skips empty keyframes "
+                             "and crops the rest; defaults to PREFILTER_MODEL")
+    parser.add_argument("--video", action="store_true", help="Also write an annotated MP4 per video")
+    parser.add_argument("--no-track", action="store_true",
+                        help="Write annotated videos as a 1 FPS keyframe slideshow instead of tracking boxes")
+    parser.add_argument("--force", action="store_true", help="Re-analyze videos that already have outputs")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Main function to run the batch analysis."""
+    args = parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    videos = find_videos(args.inputs)
+    todo = [video for video in videos if args.force or not is_complete(video, args.output_dir, args.video)]
+    print(f"Found {len(videos)} videos, {len(videos) - len(todo)} already complete, {len(todo)} to analyze.")
+    if not todo:
+        return
+    if args.prefilter_model and not os.path.exists(args.prefilter_model):
+        print(f"Pre-filter model {args.prefilter_model} not found.")
+        return
+
+    options = {
+        "upload": {"max_long_side": args.max_long_side, "image_format": args.image_format, "quality": args.quality},
+        "frame_budget": args.frame_budget,
+        "batch_size": args.batch_size,
+        "max_in_flight": args.api_concurrency,
+        "track_boxes": not args.no_track,
+        "write_video": args.video,
+        "prefilter_model": args.prefilter_model,
+    }
+
+    # Spawned workers avoid forking a process that already has HTTP client threads
+    context = multiprocessing.get_context("spawn")
+    api_limiter = context.BoundedSemaphore(args.api_concurrency)
+    failures = 0
+    start_time = time.perf_counter()
+    video_metrics = []
+    prefilter_stats = []
+    with ProcessPoolExecutor(max_workers=args.processes, mp_context=context,
+                             initializer=_init_worker, initargs=(api_limiter,)) as executor:
+        futures = {executor.submit(analyze_video_file, video, args.output_dir, options): video for video in todo}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+                print(f"{summary['video']}: {summary['keyframes']} keyframes, {summary['boxes']} boxes "
+                      f"in {summary['seconds']}s")
+                video_metrics.append(summary["metrics"])
+                if summary["prefilter"]:
+                    prefilter_stats.append(summary["prefilter"])
+            except Exception as e:
+                failures += 1
+                print(f"{futures[future]}: failed: {e}")
+    print(f"Done: {len(todo) - failures} analyzed, {failures} failed.")
+
+    # JSON run summary: per-stage times (summed over threads and processes) and token usage
+    run_metrics = {
+        "videos": len(todo) - failures,
+        "failed": failures,
+        "seconds": round(time.perf_counter() - start_time, 1),
+        **combine(video_metrics),
+    }
+    if prefilter_stats:
+        totals = {key: sum(stats[key] for stats in prefilter_stats)
+                  for key in ("frames_seen", "frames_skipped", "pixels_seen", "pixels_sent")}
+        frames_seen, frames_skipped = totals["frames_seen"], totals["frames_skipped"]
+        run_metrics["prefilter"] = {
+            **totals,
+            "frames_saved": round(frames_skipped / frames_seen, 3) if frames_seen else 0.0,
+            "pixels_saved": round(1 - totals["pixels_sent"] / totals["pixels_seen"], 3) if totals["pixels_seen"] else 0.0,
+        }
+        print(f"CPU pre-filter: skipped {frames_skipped} of {frames_seen} keyframes, "
+              f"{run_metrics['prefilter']['pixels_saved']:.0%} fewer pixels sent.")
+    with open(os.path.join(args.output_dir, "run_metrics.json"), "w") as metrics_file:
+        json.dump(run_metrics, metrics_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+End-to-end benchmark of the SafeNest pipeline against the local fake Gemini API.
+Runs process_video on house_video-1.mp4 and on generated synthetic videos, each in
+a fresh process with an empty response cache, and reports frames/sec, p50/p99
+request latency per keyframe, bytes uploaded and peak RSS. Results are appended to
+a JSONL file and compared with the previous run of the same case.
+
+Example:
+    python benchmark.py --latency 0.4 --error-rate 0.02
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fake_gemini import FakeGemini, start_server
+from keyframes import FRAME_BUDGET
+from pipeline import BATCH_SIZE, MAX_IN_FLIGHT
+from video_encoder import FfmpegWriter
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = os.path.join(BOT_DIR, ".cache", "benchmark_results.jsonl")
+SYNTHETIC_DIR = os.path.join(BOT_DIR, ".cache", "benchmark_videos")
+
+# name -> (width, height, seconds, fps) of the generated videos
+SYNTHETIC_VIDEOS = {
+    "synthetic-720p": (1280, 720, 20, 30),
+    "synthetic-1080p": (1920, 1080, 10, 30),
+}
+
+def synthetic_video(name):
+    """
+    Return the path of a synthetic benchmark video, generating it on first use.
+
+    The video pans across a random "room" of colored blocks, so consecutive
+    frames change steadily and the keyframe selector has work to do.
+    """
+    width, height, seconds, fps = SYNTHETIC_VIDEOS[name]
+    path = os.path.join(SYNTHETIC_DIR, f"{name}.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(SYNTHETIC_DIR, exist_ok=True)
+    rng = np.random.default_rng(0)
+    room = np.full((height, width * 3, 3), 200, dtype=np.uint8)
+    for _ in range(60):
+        x, y = int(rng.integers(0, width * 3 - 200)), int(rng.integers(0, height - 200))
+        w, h = (int(v) for v in rng.integers(40, 200, size=2))
+        room[y:y + h, x:x + w] = rng.integers(0, 255, size=3, dtype=np.uint8)
+    total = seconds * fps
+    with FfmpegWriter(f"{path[:-4]}.part.mp4", fps, pix_fmt="bgr24") as writer:
+        for idx in range(total):
+            offset = int(idx / max(1, total - 1) * width * 2)
+            writer.write(np.ascontiguousarray(room[:, offset:offset + width]))
+    os.replace(f"{path[:-4]}.part.mp4", path)
+    return path
+
+def run_case(video_path, options):
+    """
+    Run the pipeline on one video and measure it. Runs in a fresh process.
+
+    Args:
+        video_path (str): Video to analyze
+        options (dict): frame_budget, max_in_flight, batch_size and track_boxes
+
+    Returns:
+        dict: The measurements
+    """
+    import pipeline
+    pipeline.quiet_streamlit()
+    from context_cache import get_context_cache
+    from metrics import METRICS
+    from preprocess import UploadPreprocessor
+
+    latencies = []
+    analyze_batch = pipeline.get_bounding_boxes_for_batch
+
+    def timed_batch(images, *args, **kwargs):
+        start = time.perf_counter()
+        results = analyze_batch(images, *args, **kwargs)
+        latencies.extend([time.perf_counter() - start] * len(images))
+        return results
+
+    pipeline.get_bounding_boxes_for_batch = timed_batch
+    preprocessor = UploadPreprocessor()
+    errors = []
+    frames = keyframes = 0
+    output_path = os.path.join(tempfile.mkdtemp(), "annotated.mp4")
+
+    start = time.perf_counter()
+    first_result = None
+    for frame, _ in pipeline.process_video(video_path, output_path, preprocessor=preprocessor,
+                                           on_error=errors.append, **options):
+        frames += 1
+        keyframes += frame.keyframe
+        if first_result is None:
+            first_result = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    return {
+        "frames": frames,
+        "keyframes": keyframes,
+        "seconds": round(elapsed, 3),
+        "frames_per_second": round(frames / elapsed, 2),
+        "keyframes_per_second": round(keyframes / elapsed, 2),
+        "first_result_seconds": round(first_result or 0.0, 3),
+        "latency_p50": round(float(np.percentile(latencies, 50)), 3) if latencies else None,
+        "latency_p99": round(float(np.percentile(latencies, 99)), 3) if latencies else None,
+        "requests": preprocessor.requests,
+        "frames_uploaded": preprocessor.frames_uploaded,
+        "bytes_uploaded": preprocessor.bytes_uploaded,
+        "errors": len(errors),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "context_cache": get_context_cache().stats(),
+        # Per-stage breakdown (this process ran only this case)
+        **METRICS.snapshot(),
+    }
+
+def git_revision():
+    """Return the current git commit, or None outside a repository."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=BOT_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_result(results_path, case, settings):
+    """Return the last saved result for the same case and settings, or None."""
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path) as results_file:
+        for line in results_file:
+            record = json.loads(line)
+            if record["case"] == case and record["settings"] == settings:
+                previous = record
+    return previous
+
+def format_change(current, previous, key):
+    """Format the relative change of a metric since the previous run, e.g. " (+4.2%)"."""
+    if not previous or not previous["metrics"].get(key) or current.get(key) is None:
+        return ""
+    change = (current[key] - previous["metrics"][key]) / previous["metrics"][key] * 100
+    return f" ({change:+.1f}%)"
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark the hazard pipeline against the fake Gemini API.")
+    parser.add_argument("--cases", nargs="+", default=["house", *SYNTHETIC_VIDEOS],
+                        help="Cases to run: 'house', synthetic video names or video paths")
+    parser.add_argument("--latency", type=float, default=0.4, help="Mean fake API latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake requests failing")
+    parser.add_argument("--frame-budget", type=int, default=FRAME_BUDGET)
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-track", action="store_true")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSONL file the results are appended to")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Main function to run the benchmark."""
+    args = parse_args(argv)
+    server, base_url = start_server(FakeGemini(latency=args.latency, error_rate=args.error_rate, seed=0))
+    # Inherited by the spawned case processes
+    os.environ["GEMINI_BASE_URL"] = base_url
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+    options = {
+        "frame_budget": args.frame_budget,
+        "max_in_flight": args.max_in_flight,
+        "batch_size": args.batch_size,
+        "track_boxes": not args.no_track,
+    }
+    settings = {**options, "latency": args.latency, "error_rate": args.error_rate}
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    revision = git_revision()
+
+    context = multiprocessing.get_context("spawn")
+    try:
+        for case in args.cases:
+            if case == "house":
+                video_path = os.path.join(BOT_DIR, "house_video-1.mp4")
+            elif case in SYNTHETIC_VIDEOS:
+                video_path = synthetic_video(case)
+            else:
+                video_path = case
+
+            # A fresh process per case, so peak RSS belongs to that case alone, with an empty
+            # response cache so every keyframe reaches the (fake) API
+            os.environ["RESPONSE_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "responses.sqlite3")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                metrics = executor.submit(run_case, video_path, options).result()
+
+            previous = previous_result(args.results, case, settings)
+            print(f"{case}: {metrics['frames']} frames ({metrics['keyframes']} keyframes) in {metrics['seconds']}s, "
+                  f"{metrics['frames_per_second']} frames/s{format_change(metrics, previous, 'frames_per_second')}, "
+                  f"latency p50 {metrics['latency_p50']}s{format_change(metrics, previous, 'latency_p50')} "
+                  f"p99 {metrics['latency_p99']}s, first result {metrics['first_result_seconds']}s, "
+                  f"{metrics['bytes_uploaded'] / 1e6:.2f} MB uploaded, peak RSS {metrics['peak_rss_mb']} MB"
+                  f"{format_change(metrics, previous, 'peak_rss_mb')}, {metrics['errors']} errors")
+
+            record = {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "revision": revision,
+                "case": case,
+                "settings": settings,
+                "metrics": metrics,
+            }
+            with open(args.results, "a") as results_file:
+                results_file.write(json.dumps(record) + "\n")
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Explicit Gemini context caching for the fixed parts of every frame request.
+The hazard prompt and the system instruction are stored once as cached content
+and each frame request references it by name instead of resending them. Handles
+are refreshed before they expire and shared between processes through their own
+SQLite registry, separate from the upload registry and keyed per endpoint and API
+key. When the API refuses to create a cache (e.g. the prompt is below the model's
+minimum cacheable size), requests fall back to sending the prompt inline. Set CONTEXT_CACHE=0 to always send it inline.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+from google.genai.types import CreateCachedContentConfig, UpdateCachedContentConfig
+
+from rate_limiter import GeminiError, call_with_retry
+
+ENABLED = os.getenv("CONTEXT_CACHE", "1") != "0"
+REGISTRY_PATH = os.getenv(
+    "CONTEXT_REGISTRY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "contexts.sqlite3"),
+)
+TTL_SECONDS = 60 * 60             # Lifetime of a cache, extended on refresh
+REFRESH_MARGIN_SECONDS = 10 * 60  # Refresh caches expiring sooner than this
+RETRY_SECONDS = 10 * 60           # Wait before trying again after the API refused a cache
+
+def context_key(model_name, system_instruction, prompt_text):
+    """
+    Return the key of the cached content for a model, system instruction and prompt.
+
+    Cached content only exists on the endpoint and project it was created with, so
+    the key also covers GEMINI_BASE_URL and the API key (hashed, never stored):
+    handles created on the fake API or with another key are never sent elsewhere.
+    """
+    return hashlib.sha256("\0".join([
+        os.getenv("GEMINI_BASE_URL") or "", os.getenv("GEMINI_API_KEY") or "",
+        model_name, system_instruction or "", prompt_text,
+    ]).encode("utf-8")).hexdigest()
+
+class ContextRegistry:
+    """
+    SQLite-backed map from context key to cached-content name and expiry, shared between processes.
+
+    A single instance can be shared between threads.
+    """
+
+    def __init__(self, path=REGISTRY_PATH, refresh_margin=REFRESH_MARGIN_SECONDS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS contexts (
+                key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def entry(self, key):
+        """Return (name, expires_at) for `key`, or None if absent or due for a refresh."""
+        with self._lock:
+            row = self._conn.execute("SELECT name, expires_at FROM contexts WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] - time.time() <= self.refresh_margin:
+            return None
+        return row
+
+    def put(self, key, name, expires_at):
+        """Record a created or refreshed cache, dropping expired ones."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO contexts (key, name, expires_at) VALUES (?, ?, ?)", (key, name, expires_at)
+            )
+            self._conn.execute("DELETE FROM contexts WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def remove(self, key):
+        """Forget the cache for `key`, e.g. after the API stopped accepting it."""
+        with self._lock:
+            self._conn.execute("DELETE FROM contexts WHERE key = ?", (key,))
+            self._conn.commit()
+
+class ContextCache:
+    """
+    Cached-content handles per (model, system instruction, prompt).
+
+    A single instance can be shared between threads; creating and refreshing a
+    handle happens under a lock, so concurrent requests never create duplicates.
+
+    Attributes:
+        hits (int): Requests that referenced a cache
+        inline (int): Requests that sent the prompt inline
+        created (int): Caches created by this process
+        refreshed (int): Caches whose lifetime this process extended
+    """
+
+    def __init__(self, registry, enabled=ENABLED, ttl_seconds=TTL_SECONDS):
+        self.registry = registry
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.inline = 0
+        self.created = 0
+        self.refreshed = 0
+        self._entries = {}           # key -> (cache name, expiry time)
+        self._unavailable_until = {}  # key -> time before which no cache is attempted
+        self._lock = threading.Lock()
+
+    def handle(self, client, model_name, system_instruction, prompt_text):
+        """
+        Return the name of a live cache holding the system instruction and prompt.
+
+        Args:
+            client (genai.Client): Client to create or refresh the cache with
+            model_name (str): Model the requests go to
+            system_instruction (str): System instruction of the requests
+            prompt_text (str): The fixed prompt sent with every frame
+
+        Returns:
+            str | None: The cache name, or None to send the prompt inline
+        """
+        key = context_key(model_name, system_instruction, prompt_text)
+        with self._lock:
+            name = self._live_handle(key, client, model_name, system_instruction, prompt_text)
+            if name is None:
+                self.inline += 1
+            else:
+                self.hits += 1
+            return name
+
+    def _live_handle(self, key, client, model_name, system_instruction, prompt_text):
+        now = time.time()
+        if not self.enabled or now < self._unavailable_until.get(key, 0):
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] - now > REFRESH_MARGIN_SECONDS:
+            return entry[0]
+
+        # Another process may already have created or refreshed the cache
+        shared = self.registry.entry(key)
+        if shared is not None:
+            self._entries[key] = shared
+            return shared[0]
+
+        cache = None
+        if entry is not None:
+            try:
+                cache = call_with_retry(lambda: client.caches.update(
+                    name=entry[0], config=UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+                ))
+                self.refreshed += 1
+            except GeminiError as e:
+                print(f"Could not refresh context cache {entry[0]}, creating a new one: {e}")
+        if cache is None:
+            try:
+                cache = call_with_retry(lambda: client.caches.create(
+                    model=model_name,
+                    config=CreateCachedContentConfig(
+                        display_name=f"safenest-{key[-12:]}",
+                        system_instruction=system_instruction,
+                        contents=[prompt_text],
+                        ttl=f"{self.ttl_seconds}s",
+                    ),
+                ))
+                self.created += 1
+            except GeminiError as e:
+                print(f"Context caching unavailable, sending the prompt inline: {e}")
+                self._entries.pop(key, None)
+                self._unavailable_until[key] = now + RETRY_SECONDS
+                return None
+
+        expires_at = cache.expire_time.timestamp() if cache.expire_time else now + self.ttl_seconds
+        self._entries[key] = (cache.name, expires_at)
+        self.registry.put(key, cache.name, expires_at)
+        return cache.name
+
+    def invalidate(self, name):
+        """Forget a cache the API no longer accepts, so the next request creates a new one."""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry[0] == name:
+                    del self._entries[key]
+                    self.registry.remove(key)
+
+    def stats(self):
+        """Return request counts and the share of requests that referenced a cache."""
+        with self._lock:
+            total = self.hits + self.inline
+            return {
+                "hits": self.hits,
+                "inline": self.inline,
+                "hit_rate": self.hits / total if total else 0.0,
+                "created": self.created,
+                "refreshed": self.refreshed,
+            }
+
+@st.cache_resource
+def get_context_cache():
+    """Return the process-wide context cache."""
+    return ContextCache(ContextRegistry())
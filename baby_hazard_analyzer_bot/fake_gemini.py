@@ -0,0 +1,356 @@
+"""
+Local stand-in for the Gemini API, for offline development and benchmarks.
+Serves generateContent, streamGenerateContent and the Files and cachedContents API
+endpoints used by this project with canned BoundingBox responses, a configurable
+latency and a configurable rate of 429/503 errors. Point the app at it with GEMINI_BASE_URL.
+
+Example:
+    python fake_gemini.py --port 8765 --latency 0.4 --error-rate 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=fake streamlit run app.py
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+DEFAULT_PORT = 8765
+LATENCY_SECONDS = 0.5        # Mean generate latency
+LATENCY_JITTER = 0.5         # Latency varies uniformly by +/- this fraction of the mean
+ERROR_RATE = 0.0             # Fraction of generate requests failing with 429 or 503
+FILE_PROCESSING_SECONDS = 1.0
+FILE_TTL_HOURS = 48
+STREAM_CHUNK_CHARS = 40
+IMAGE_TOKENS = 258           # Tokens Gemini bills per image
+MIN_CACHE_TOKENS = 0         # Smallest cached content accepted (the real API needs thousands of tokens)
+
+CANNED_BOXES = [
+    {"box_2d": [620, 80, 760, 180], "label": "exposed electrical outlet"},
+    {"box_2d": [700, 300, 980, 420], "label": "dangling cord"},
+    {"box_2d": [400, 550, 640, 900], "label": "sharp table corner"},
+    {"box_2d": [850, 600, 990, 700], "label": "bottle on the floor"},
+    {"box_2d": [150, 700, 560, 980], "label": "unstable bookshelf"},
+]
+
+class FakeGemini:
+    """
+    State and behavior of the fake API.
+
+    Attributes:
+        latency (float): Mean seconds before a generate response (or its first chunk)
+        error_rate (float): Fraction of generate requests failing with 429 (with Retry-After) or 503
+        boxes (list[dict]): Boxes a response picks from, in 0-1000 coordinates
+        requests (int): Generate requests served
+        bytes_received (int): Request body bytes received
+        min_cache_tokens (int): Cached contents smaller than this are refused with a 400
+    """
+
+    def __init__(self, latency=LATENCY_SECONDS, error_rate=ERROR_RATE, boxes=None, seed=None,
+                 min_cache_tokens=MIN_CACHE_TOKENS):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.boxes = boxes or CANNED_BOXES
+        self.min_cache_tokens = min_cache_tokens
+        self.requests = 0
+        self.bytes_received = 0
+        self._random = random.Random(seed)
+        self._files = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def sleep(self):
+        time.sleep(max(0.0, self.latency * (1 + self._random.uniform(-LATENCY_JITTER, LATENCY_JITTER))))
+
+    def pick_error(self):
+        """Return an (HTTP status, body, headers) error to serve, or None."""
+        with self._lock:
+            self.requests += 1
+            if self._random.random() >= self.error_rate:
+                return None
+            quota = self._random.random() < 0.5
+        if quota:
+            return 429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Quota exceeded (fake)"}}, \
+                {"Retry-After": "1"}
+        return 503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "Overloaded (fake)"}}, {}
+
+    def response_text(self, request):
+        """Build the canned JSON answer for a generate request, with frame indices for multi-frame requests."""
+        texts = [part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", [])]
+        frames = [int(match.group(1)) for text in texts for match in [re.fullmatch(r"Frame (\d+):", text)] if match]
+        with self._lock:
+            if frames:
+                entries = [{**box, "frame_index": frame} for frame in frames
+                           for box in self._random.sample(self.boxes, self._random.randint(0, 3))]
+            else:
+                entries = self._random.sample(self.boxes, self._random.randint(0, 3))
+        return json.dumps(entries)
+
+    def create_file(self, display_name, mime_type, size):
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._files[name] = {
+                "name": name,
+                "displayName": display_name,
+                "mimeType": mime_type,
+                "sizeBytes": str(size),
+                "createTime": now.isoformat(),
+                "expirationTime": (now + timedelta(hours=FILE_TTL_HOURS)).isoformat(),
+                "uri": f"fake://{name}",
+                "_ready_at": time.monotonic() + FILE_PROCESSING_SECONDS,
+            }
+        return name
+
+    def get_file(self, name):
+        with self._lock:
+            file = self._files.get(name)
+        if file is None:
+            return None
+        state = "ACTIVE" if time.monotonic() >= file["_ready_at"] else "PROCESSING"
+        return {**{k: v for k, v in file.items() if not k.startswith("_")}, "state": state}
+
+    def delete_file(self, name):
+        with self._lock:
+            return self._files.pop(name, None) is not None
+
+    def create_cache(self, request):
+        """Store cached content, returning its resource or None if it is too small to cache."""
+        tokens = prompt_tokens(request.get("contents", []) + [request.get("systemInstruction") or {}])
+        if tokens < self.min_cache_tokens:
+            return None
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        now = datetime.now(timezone.utc)
+        cache = {
+            "name": name,
+            "model": request.get("model"),
+            "displayName": request.get("displayName"),
+            "createTime": now.isoformat(),
+            "usageMetadata": {"totalTokenCount": tokens},
+        }
+        with self._lock:
+            self._caches[name] = cache
+            return _set_ttl(cache, request.get("ttl"), now)
+
+    def update_cache(self, name, ttl):
+        """Extend a cache's lifetime by `ttl` (e.g. "3600s") from now, returning it or None if unknown."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            cache = self._caches.get(name)
+            if cache is None or cache["_expires_at"] < now:
+                return None
+            return _set_ttl(cache, ttl, now)
+
+    def cache_tokens(self, name):
+        """Return the token count of a live cache, or None if it doesn't exist or expired."""
+        with self._lock:
+            cache = self._caches.get(name)
+            if cache is None or cache["_expires_at"] < datetime.now(timezone.utc):
+                return None
+            return cache["usageMetadata"]["totalTokenCount"]
+
+    def delete_cache(self, name):
+        with self._lock:
+            return self._caches.pop(name, None) is not None
+
+def _set_ttl(cache, ttl, now):
+    # Returns the cache resource as the API would serve it
+    cache["_expires_at"] = now + timedelta(seconds=float((ttl or "3600s").rstrip("s")))
+    cache["updateTime"] = now.isoformat()
+    cache["expireTime"] = cache["_expires_at"].isoformat()
+    return {k: v for k, v in cache.items() if not k.startswith("_")}
+
+def prompt_tokens(contents):
+    """Estimate the tokens of request contents (~4 characters per token)."""
+    parts = [part for content in contents for part in content.get("parts", [])]
+    return sum(IMAGE_TOKENS if "inlineData" in part or "fileData" in part else len(part.get("text", "")) // 4 + 1
+               for part in parts)
+
+def usage_metadata(request, text, cached_tokens=0):
+    """Estimate token usage for a request (plus its cached content) and its full response text."""
+    prompt = prompt_tokens(request.get("contents", []) + [request.get("systemInstruction") or {}]) + cached_tokens
+    output = len(text) // 4 + 1
+    usage = {"promptTokenCount": prompt, "candidatesTokenCount": output, "totalTokenCount": prompt + output}
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+    return usage
+
+def _candidate(text, usage=None):
+    # Only the final response (or final stream chunk) has a finish reason and usage metadata
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}}
+    response = {"candidates": [candidate]}
+    if usage:
+        candidate["finishReason"] = "STOP"
+        response["usageMetadata"] = usage
+    return response
+
+def make_handler(fake):
+    """Create the request handler class serving `fake`."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            with fake._lock:
+                fake.bytes_received += len(body)
+            return body
+
+        def _send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = self._read_body()
+
+            if path == "/upload/v1beta/files":
+                # Resumable upload start: hand out an upload URL
+                request = json.loads(body or b"{}").get("file", {})
+                name = fake.create_file(request.get("displayName"),
+                                        self.headers.get("X-Goog-Upload-Header-Content-Type"),
+                                        int(self.headers.get("X-Goog-Upload-Header-Content-Length") or 0))
+                host = self.headers.get("Host")
+                self._send_json(200, {}, {"X-Goog-Upload-URL": f"http://{host}/upload-session/{name}"})
+                return
+            if path.startswith("/upload-session/"):
+                name = path[len("/upload-session/"):]
+                finalize = "finalize" in self.headers.get("X-Goog-Upload-Command", "")
+                self._send_json(200, {"file": fake.get_file(name)} if finalize else {},
+                                {"X-Goog-Upload-Status": "final" if finalize else "active"})
+                return
+
+            if re.fullmatch(r"/[^/]+/cachedContents", path):
+                cache = fake.create_cache(json.loads(body or b"{}"))
+                if cache is None:
+                    self._send_json(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT",
+                                                    "message": "Cached content is too small (fake)"}})
+                else:
+                    self._send_json(200, cache)
+                return
+
+            match = re.fullmatch(r"/[^/]+/models/([^/:]+):(generateContent|streamGenerateContent)", path)
+            if not match:
+                self._send_json(404, {"error": {"code": 404, "status": "NOT_FOUND", "message": path}})
+                return
+            fake.sleep()
+            error = fake.pick_error()
+            if error:
+                self._send_json(*error)
+                return
+            request = json.loads(body or b"{}")
+            cached_tokens = 0
+            if request.get("cachedContent"):
+                cached_tokens = fake.cache_tokens(request["cachedContent"])
+                if cached_tokens is None:
+                    self._send_json(403, {"error": {"code": 403, "status": "PERMISSION_DENIED",
+                                                    "message": "CachedContent not found (or permission denied)"}})
+                    return
+            text = fake.response_text(request)
+            usage = usage_metadata(request, text, cached_tokens)
+            if match.group(2) == "generateContent":
+                self._send_json(200, _candidate(text, usage))
+                return
+
+            # Server-sent events, one chunk of the JSON text per event
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+            for idx, piece in enumerate(pieces):
+                event = f"data: {json.dumps(_candidate(piece, usage if idx == len(pieces) - 1 else None))}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_PATCH(self):
+            body = self._read_body()
+            match = re.fullmatch(r"/[^/]+/(cachedContents/[^/]+)", urlparse(self.path).path)
+            cache = fake.update_cache(match.group(1), json.loads(body or b"{}").get("ttl")) if match else None
+            if cache is None:
+                self._send_json(404, {"error": {"code": 404, "status": "NOT_FOUND", "message": self.path}})
+            else:
+                self._send_json(200, cache)
+
+        def do_GET(self):
+            match = re.fullmatch(r"/[^/]+/(files/[^/]+)", urlparse(self.path).path)
+            file = fake.get_file(match.group(1)) if match else None
+            if file is None:
+                self._send_json(404, {"error": {"code": 404, "status": "NOT_FOUND", "message": self.path}})
+            else:
+                self._send_json(200, file)
+
+        def do_DELETE(self):
+            match = re.fullmatch(r"/[^/]+/((files|cachedContents)/[^/]+)", urlparse(self.path).path)
+            deleted = match and (fake.delete_file(match.group(1)) if match.group(2) == "files"
+                                 else fake.delete_cache(match.group(1)))
+            if deleted:
+                self._send_json(200, {})
+            else:
+                self._send_json(404, {"error": {"code": 404, "status": "NOT_FOUND", "message": self.path}})
+
+    return Handler
+
+def start_server(fake=None, host="127.0.0.1", port=0):
+    """
+    Start the fake API on a background thread.
+
+    Args:
+        fake (FakeGemini): Behavior to serve; defaults are used if omitted
+        host (str): Interface to bind
+        port (int): Port to bind, or 0 for any free port
+
+    Returns:
+        tuple: (server, base URL); call server.shutdown() to stop it
+    """
+    fake = fake or FakeGemini()
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    """Run the fake API in the foreground."""
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Gemini API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=LATENCY_SECONDS, help="Mean response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="Fraction of requests failing with 429/503")
+    parser.add_argument("--boxes", help="JSON file with a list of canned boxes in 0-1000 coordinates")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--min-cache-tokens", type=int, default=MIN_CACHE_TOKENS,
+                        help="Refuse cached contents smaller than this, like the real API")
+    args = parser.parse_args()
+
+    boxes = None
+    if args.boxes:
+        with open(args.boxes) as boxes_file:
+            boxes = json.load(boxes_file)
+    fake = FakeGemini(latency=args.latency, error_rate=args.error_rate, boxes=boxes, seed=args.seed,
+                      min_cache_tokens=args.min_cache_tokens)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Fake Gemini API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Local registry of videos uploaded to the Gemini Files API, stored in SQLite.
+Each file's content hash maps to the name of its upload and the time the upload
+expires, so analyzing the same video again reuses the uploaded file instead of
+uploading it and waiting for it to be processed.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+REGISTRY_PATH = os.getenv(
+    "FILE_REGISTRY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "files.sqlite3"),
+)
+EXPIRY_MARGIN_SECONDS = 10 * 60  # Uploads expiring sooner than this are not reused
+CHUNK_SIZE = 1 << 20
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class FileRegistry:
+    """
+    SQLite-backed map from content hash to uploaded file name and expiry.
+
+    A single instance can be shared between threads.
+    """
+
+    def __init__(self, path=REGISTRY_PATH, expiry_margin=EXPIRY_MARGIN_SECONDS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.expiry_margin = expiry_margin
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                hash TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, content_hash):
+        """Return the uploaded file name for `content_hash`, or None if absent or about to expire."""
+        entry = self.entry(content_hash)
+        return entry[0] if entry else None
+
+    def entry(self, content_hash):
+        """Return (name, expires_at) for `content_hash`, or None if absent or about to expire."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT name, expires_at FROM files WHERE hash = ?", (content_hash,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] - time.time() < self.expiry_margin:
+                self._conn.execute("DELETE FROM files WHERE hash = ?", (content_hash,))
+                self._conn.commit()
+                return None
+            return row
+
+    def put(self, content_hash, name, expires_at):
+        """
+        Record an uploaded file.
+
+        Args:
+            content_hash (str): SHA-256 of the file's contents
+            name (str): Files API name of the upload, e.g. "files/abc123"
+            expires_at (float): Unix time at which the upload expires
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (hash, name, expires_at) VALUES (?, ?, ?)",
+                (content_hash, name, expires_at),
+            )
+            # Drop expired entries while we're at it
+            self._conn.execute("DELETE FROM files WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def remove(self, content_hash):
+        """Forget the upload for `content_hash`, e.g. after the API reports it missing."""
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE hash = ?", (content_hash,))
+            self._conn.commit()
+
+@st.cache_resource
+def get_file_registry():
+    """Return the process-wide file registry."""
+    return FileRegistry()
@@ -0,0 +1,95 @@
+"""
+Streaming frame extraction for room videos.
+Frames are pulled from the decoder one at a time and only the keyframes are
+decoded into pixels, so memory use does not grow with the length of the video.
+"""
+
+import cv2
+
+from frames import Frame
+from keyframes import KeyframeSelector
+from metrics import stage
+
+def open_video(video_path):
+    """
+    Open a video and read its basic properties.
+
+    OpenCV's automatic rotation is turned off; the container's rotation
+    metadata is returned instead so it can be applied once, where needed.
+
+    Args:
+        video_path (str): Path to the video file
+
+    Returns:
+        tuple: (cv2.VideoCapture, fps, total frame count, clockwise rotation in degrees)
+
+    Raises:
+        ValueError: If the video cannot be opened or has no FPS
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not cap.isOpened() or fps == 0:
+        cap.release()
+        raise ValueError("Could not retrieve FPS from the video.")
+    cap.set(cv2.CAP_PROP_ORIENTATION_AUTO, 0)
+    rotation = int(cap.get(cv2.CAP_PROP_ORIENTATION_META)) % 360
+    return cap, fps, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), rotation
+
+def iter_keyframes(video_path, **selector_args):
+    """
+    Lazily yield the keyframes of a video.
+
+    Every frame is demuxed with `grab()`, but only frames the selector wants to
+    look at are decoded with `retrieve()`; nothing is kept after it is yielded.
+
+    Args:
+        video_path (str): Path to the video file
+        **selector_args: Extra arguments for KeyframeSelector (threshold, budget, ...)
+
+    Yields:
+        Frame: Each keyframe, as decoded (BGR) with the video's rotation attached
+    """
+    cap, fps, total_frames, rotation = open_video(video_path)
+    selector = KeyframeSelector(fps, total_frames, **selector_args)
+    try:
+        frame_idx = 0
+        while True:
+            with stage("decode"):
+                grabbed = cap.grab()
+            if not grabbed:
+                break
+            if selector.wants(frame_idx):
+                with stage("decode"):
+                    ret, frame = cap.retrieve()
+                with stage("keyframe_select"):
+                    selected = ret and selector.is_keyframe(frame_idx, frame)
+                if selected:
+                    yield Frame(frame, frame_idx, "BGR", rotation, keyframe=True)
+            elif selector.budget and selector.selected >= selector.budget:
+                break
+            frame_idx += 1
+    finally:
+        cap.release()
+
+def iter_frames(video_path):
+    """
+    Lazily yield every frame of a video.
+
+    Args:
+        video_path (str): Path to the video file
+
+    Yields:
+        Frame: Each frame, as decoded (BGR) with the video's rotation attached
+    """
+    cap, _, _, rotation = open_video(video_path)
+    try:
+        frame_idx = 0
+        while True:
+            with stage("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            yield Frame(frame, frame_idx, "BGR", rotation)
+            frame_idx += 1
+    finally:
+        cap.release()
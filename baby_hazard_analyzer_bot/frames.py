@@ -0,0 +1,61 @@
+"""
+Internal frame representation for the video pipeline.
+A frame is the decoder's NumPy array plus metadata for its color order and the
+rotation needed to display it upright, so conversions only happen (once) at the
+API and encoder boundaries instead of after every stage.
+"""
+
+from dataclasses import dataclass, replace
+
+import numpy as np
+from PIL import Image
+
+@dataclass
+class Frame:
+    """
+    A decoded video frame.
+
+    Attributes:
+        pixels (np.ndarray): H x W x 3 uint8 array, exactly as stored (no copies are made on creation)
+        index (int): Index of the frame in the video
+        color_order (str): Channel order of `pixels`, "BGR" (OpenCV) or "RGB"
+        rotation (int): Clockwise rotation in degrees (0, 90, 180, 270) still to apply to display upright
+        keyframe (bool): Whether the frame was selected for analysis by the model
+    """
+
+    pixels: np.ndarray
+    index: int = 0
+    color_order: str = "BGR"
+    rotation: int = 0
+    keyframe: bool = False
+
+    @property
+    def size(self):
+        """(width, height) of the frame once displayed upright."""
+        height, width = self.pixels.shape[:2]
+        return (height, width) if self.rotation % 180 else (width, height)
+
+    def _upright_view(self):
+        # np.rot90 returns a view; k is counter-clockwise quarter turns
+        return np.rot90(self.pixels, k=-(self.rotation // 90) % 4)
+
+    def upright(self):
+        """Return this frame rotated upright, copying the pixels only if a rotation is needed."""
+        if self.rotation % 360 == 0:
+            return self
+        return replace(self, pixels=np.ascontiguousarray(self._upright_view()), rotation=0)
+
+    def to_pil(self):
+        """Convert to an upright RGB PIL image, in a single copy."""
+        view = self._upright_view()
+        if self.color_order == "BGR":
+            view = view[:, :, ::-1]
+        return Image.fromarray(np.ascontiguousarray(view))
+
+def to_pil(image):
+    """Return `image` (a Frame, an RGB np.ndarray or a PIL image) as a PIL image."""
+    if isinstance(image, Frame):
+        return image.to_pil()
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    return image
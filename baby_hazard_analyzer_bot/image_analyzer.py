@@ -3,7 +3,9 @@ Image analysis using Google's Gemini API.
 This script takes an image and generates a creative description focusing on outfit colors.
 """
 
+import importlib.util
 import os
+import streamlit as st
 from PIL import Image
 from google import genai
 from google.genai.types import GenerateContentConfig, HttpOptions, Part, SafetySetting
@@ -11,6 +13,13 @@ from dotenv import load_dotenv
 
 from pydantic import BaseModel
 
+from context_cache import get_context_cache
+from json_stream import JsonArrayParser
+from metrics import METRICS, stage
+from rate_limiter import RequestError, call_with_retry, classify_error
+
+MODEL_NAME = "gemini-2.0-flash"
+
 # Helper class to represent a bounding box
 class BoundingBox(BaseModel):
     """
@@ -25,8 +34,56 @@ class BoundingBox(BaseModel):
     box_2d: list[int]
     label: str
 
+# Request config for bounding box detection, built once and shared by every call
+BOUNDING_BOX_CONFIG = GenerateContentConfig(
+    system_instruction="""
+    Return bounding boxes as an array with labels.
+    Never return masks. Limit to 25 objects.
+    If an object is present multiple times, give each object a unique label
+    according to its distinct characteristics (colors, size, position, etc..).
+    """,
+    temperature=0.5,
+    safety_settings=[
+        SafetySetting(
+            category="HARM_CATEGORY_DANGEROUS_CONTENT",
+            threshold="BLOCK_ONLY_HIGH",
+        ),
+    ],
+    response_mime_type="application/json",
+    response_schema=list[BoundingBox],  # Add BoundingBox class to the response schema
+)
+
+class FrameBoundingBox(BoundingBox):
+    """
+    A bounding box found in one frame of a multi-frame request.
+
+    Attributes:
+        frame_index (int): Index of the frame (in request order) the box belongs to
+    """
+
+    frame_index: int
+
+# Request config for analyzing several frames in a single request
+BATCH_BOUNDING_BOX_CONFIG = BOUNDING_BOX_CONFIG.model_copy(update={
+    "system_instruction": BOUNDING_BOX_CONFIG.system_instruction + """
+    You will receive several images, each preceded by its label "Frame N:".
+    Analyze every frame independently and set "frame_index" to N for each box.
+    """,
+    "response_schema": list[FrameBoundingBox],
+})
+
+@st.cache_resource
 def setup_client():
-    """Initialize and return the Gemini API client."""
+    """
+    Initialize and return the process-wide Gemini API client.
+
+    The client is created once and shared across Streamlit reruns and threads,
+    so its HTTP connection pool (and the TLS sessions in it) are reused
+    between requests instead of being rebuilt for every frame.
+
+    Set GEMINI_BASE_URL to send requests elsewhere, e.g. to the local stand-in
+    in fake_gemini.py.
+    """
     # Load environment variables from .env file
     load_dotenv()
     
@@ -34,54 +91,177 @@ def setup_client():
     if not api_key:
         raise EnvironmentError("GEMINI_API_KEY environment variable not found. Please check your .env file.")
     
-    return genai.Client(api_key=api_key)
+    # Multiplex requests over HTTP/2 when the h2 package is available
+    client_args = {"http2": True} if importlib.util.find_spec("h2") else {}
+    return genai.Client(
+        api_key=api_key,
+        http_options=HttpOptions(
+            base_url=os.getenv("GEMINI_BASE_URL") or None,
+            client_args=client_args,
+            async_client_args=client_args,
+        ),
+    )
 
-def analyze_image(image, prompt_text, model_name="gemini-2.0-flash"):
+def call_with_context(client, model_name, config, contents, prompt_text, send):
+    """
+    Make a request, referencing the system instruction and prompt in the context cache when possible.
+
+    Args:
+        client (genai.Client): The Gemini client
+        model_name (str): Name of the Gemini model to use
+        config (GenerateContentConfig): Request config, including the system instruction
+        contents (list): Request contents without the prompt
+        prompt_text (str): The fixed prompt, cached or appended to the contents
+        send (callable): send(contents, config) makes one request attempt
+
+    Returns:
+        The return value of `send`
+
+    Raises:
+        GeminiError: If the request failed, after retrying rate-limit and transient errors
+    """
+    context = get_context_cache()
+    name = context.handle(client, model_name, config.system_instruction, prompt_text)
+    if name is not None:
+        cached_config = config.model_copy(update={"system_instruction": None, "cached_content": name})
+        try:
+            return call_with_retry(lambda: send(contents, cached_config))
+        except RequestError as e:
+            # The cache expired or was deleted behind our back: forget it and send this request inline
+            if "cache" not in str(e).lower():
+                raise
+            print(f"Context cache {name} rejected, sending the prompt inline: {e}")
+            context.invalidate(name)
+    return call_with_retry(lambda: send([*contents, prompt_text], config))
+
+def analyze_image(image, prompt_text, model_name=MODEL_NAME):
     """
     Analyze an image using Google's Gemini model.
     
     Args:
-        image (Image): Image file
+        image (Image | Part): Image file, or an already encoded image part
         prompt_text (str): Text prompt to send with the image
         model_name (str): Name of the Gemini model to use
         
     Returns:
         str: The generated response text
+
+    Raises:
+        GeminiError: If the request failed, after retrying rate-limit and transient errors
     """
-    try:
-        # Setup client
-        client = setup_client()
+    # Setup client
+    client = setup_client()
 
-        config = GenerateContentConfig(
-            system_instruction="""
-            Return bounding boxes as an array with labels.
-            Never return masks. Limit to 25 objects.
-            If an object is present multiple times, give each object a unique label
-            according to its distinct characteristics (colors, size, position, etc..).
-            """,
-            temperature=0.5,
-            safety_settings=[
-                SafetySetting(
-                    category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                    threshold="BLOCK_ONLY_HIGH",
-                ),
-            ],
-            response_mime_type="application/json",
-            response_schema=list[BoundingBox],  # Add BoundingBox class to the response schema
-        )
-        
-        # Generate content
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[image, prompt_text],
-            config=config
-        )
+    # Generate content
+    with stage("model"):
+        response = call_with_context(client, model_name, BOUNDING_BOX_CONFIG, [image], prompt_text,
+                                     lambda contents, config: client.models.generate_content(
+                                         model=model_name, contents=contents, config=config))
+    METRICS.add_usage(response.usage_metadata)
+
+    return response.text
+
+def detect_boxes(image, prompt_text, model_name=MODEL_NAME):
+    """
+    Detect bounding boxes in an image, using the SDK's parsed response.
+
+    Args:
+        image (Image | Part): Image file, or an already encoded image part
+        prompt_text (str): Text prompt to send with the image
+        model_name (str): Name of the Gemini model to use
+
+    Returns:
+        list[BoundingBox] | None: The boxes, or None if the response didn't match the schema
+
+    Raises:
+        GeminiError: If the request failed, after retrying rate-limit and transient errors
+    """
+    client = setup_client()
+    with stage("model"):
+        response = call_with_context(client, model_name, BOUNDING_BOX_CONFIG, [image], prompt_text,
+                                     lambda contents, config: client.models.generate_content(
+                                         model=model_name, contents=contents, config=config))
+    METRICS.add_usage(response.usage_metadata)
+    return response.parsed
+
+def stream_boxes(image, prompt_text, model_name=MODEL_NAME):
+    """
+    Detect bounding boxes in an image, yielding each box as soon as it has been generated.
+
+    The response is streamed and parsed incrementally, so the first boxes are
+    available long before the full response is complete.
+
+    Args:
+        image (Image | Part): Image file, or an already encoded image part
+        prompt_text (str): Text prompt to send with the image
+        model_name (str): Name of the Gemini model to use
+
+    Yields:
+        BoundingBox: Each box, in response order
+
+    Raises:
+        GeminiError: If the request failed (retried only until the first chunk arrives)
+        json.JSONDecodeError, pydantic.ValidationError: If the response is malformed or incomplete
+    """
+    client = setup_client()
+
+    def open_stream(contents, config):
+        chunks = client.models.generate_content_stream(model=model_name, contents=contents, config=config)
+        # Wait for the first chunk here, so quota and connection errors are retried
+        return next(chunks, None), chunks
+
+    with stage("model"):
+        first, chunks = call_with_context(client, model_name, BOUNDING_BOX_CONFIG, [image], prompt_text, open_stream)
+    parser = JsonArrayParser()
+    chunk, usage = first, None
+    while chunk is not None:
+        usage = chunk.usage_metadata or usage
+        with stage("parse"):
+            items = [BoundingBox.model_validate(item) for item in parser.feed(chunk.text or "")]
+        yield from items
+        try:
+            with stage("model"):
+                chunk = next(chunks, None)
+        except Exception as e:
+            raise classify_error(e) from e
+    # A response cut off before the closing bracket (token limit, dropped connection) is incomplete
+    parser.close()
+    # The last chunk carries the token counts for the whole response
+    METRICS.add_usage(usage)
+
+def analyze_images(images, prompt_text, model_name=MODEL_NAME):
+    """
+    Analyze several images in a single request using Google's Gemini model.
+    
+    Args:
+        images (list[Image | Part]): Images to analyze, labeled "Frame 0:", "Frame 1:", ... in the request
+        prompt_text (str): Text prompt to send with the images
+        model_name (str): Name of the Gemini model to use
         
-        return response.text
-    except Exception as e:
-        return f"Error generating content: {str(e)}"
+    Returns:
+        list[FrameBoundingBox] | None: The boxes parsed by the SDK, each with its "frame_index",
+        or None if the response didn't match the schema
+
+    Raises:
+        GeminiError: If the request failed, after retrying rate-limit and transient errors
+    """
+    # Setup client
+    client = setup_client()
+
+    contents = []
+    for idx, image in enumerate(images):
+        contents += [f"Frame {idx}:", image]
+
+    # Generate content
+    with stage("model"):
+        response = call_with_context(client, model_name, BATCH_BOUNDING_BOX_CONFIG, contents, prompt_text,
+                                     lambda contents, config: client.models.generate_content(
+                                         model=model_name, contents=contents, config=config))
+    METRICS.add_usage(response.usage_metadata)
+
+    return response.parsed
 
-def analyze_image_from_path(image_path, prompt_text, model_name="gemini-2.0-flash"):
+def analyze_image_from_path(image_path, prompt_text, model_name=MODEL_NAME):
     """
     Analyze an image using Google's Gemini model.
     
@@ -0,0 +1,440 @@
+"""
+Background analysis jobs for the SafeNest page.
+Uploads are queued as jobs in SQLite and run by a pool of worker processes, so the
+pipeline never runs on a Streamlit script thread and keeps going when the browser
+disconnects. Workers record progress, the hazards found so far and the latest
+annotated keyframe on the job, which the page polls; a returning user reattaches by
+job ID. Jobs are limited globally and per user, and a semaphore shared by all
+workers caps the number of Gemini requests in flight.
+
+The queue assumes a single Streamlit server process owns the worker pool.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import streamlit as st
+
+from metrics import METRICS
+from scratch import QUOTA_BYTES, enforce_quota, hash_upload, sweep
+
+JOBS_PATH = os.getenv(
+    "JOBS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "jobs.sqlite3"),
+)
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "jobs"))
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+MAX_JOBS_PER_USER = 1          # Running jobs per user; further uploads wait in the queue
+MAX_IN_FLIGHT_PER_USER = 8     # Gemini requests in flight per job (and so per user)
+MAX_IN_FLIGHT_TOTAL = 16       # Gemini requests in flight across all jobs
+DISPATCH_INTERVAL_SECONDS = 1  # How often the dispatcher checks the queue without being woken
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Job fields stored as JSON
+_JSON_FIELDS = ("settings", "hazards", "errors", "result")
+
+def upload_key(upload, settings):
+    """
+    Build the key identifying the analysis of an upload, for reusing finished jobs.
+
+    Args:
+        upload (BinaryIO): The uploaded file, hashed in chunks
+        settings (dict): JSON-serializable settings that affect the result
+
+    Returns:
+        str: The key
+    """
+    upload_hash = hash_upload(upload)
+    settings_hash = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{upload_hash}:{settings_hash}"
+
+def can_retry(job):
+    """Return whether analyzing a job's upload again could help: it failed, had failed requests or its output is gone."""
+    if job["status"] == FAILED:
+        return True
+    return job["status"] == DONE and (bool(job["errors"]) or not os.path.exists(job["output_path"]))
+
+def job_dir(job_id, jobs_dir=JOBS_DIR):
+    """Return the directory holding a job's input, preview and output files."""
+    return os.path.join(jobs_dir, job_id)
+
+class JobStore:
+    """
+    SQLite-backed job records, shared by the page and the worker processes.
+
+    A single instance can be shared between threads; each process opens its own.
+    """
+
+    def __init__(self, path=JOBS_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user TEXT NOT NULL,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                video_path TEXT NOT NULL,
+                output_path TEXT NOT NULL,
+                preview_path TEXT,
+                progress INTEGER NOT NULL DEFAULT 0,
+                hazards TEXT NOT NULL DEFAULT '{}',
+                errors TEXT NOT NULL DEFAULT '[]',
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+        self._conn.commit()
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        for field in _JSON_FIELDS:
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def submit(self, user, key, settings, video_path, output_path, job_id=None):
+        """
+        Queue a job.
+
+        Args:
+            user (str): ID of the submitting user
+            key (str): upload_key of the upload and settings
+            settings (dict): Keyword arguments for the analysis (see run_job)
+            video_path (str): Input video, owned by the job from now on
+            output_path (str): Where the annotated video will be written
+            job_id (str): ID to use, e.g. one the input was already stored under
+
+        Returns:
+            str: The job ID
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, user, key, status, settings, video_path, output_path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user, key, QUEUED, json.dumps(settings), video_path, output_path, now, now),
+            )
+            self._conn.commit()
+        return job_id
+
+    def get(self, job_id):
+        """Return a job as a dict, or None if there is no such job."""
+        with self._lock:
+            return self._to_dict(self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def find(self, key):
+        """Return the latest job for `key` whatever its status, or None (see can_retry)."""
+        with self._lock:
+            return self._to_dict(self._conn.execute(
+                "SELECT * FROM jobs WHERE key = ? ORDER BY created_at DESC LIMIT 1", (key,)
+            ).fetchone())
+
+    def jobs_for(self, user, limit=10):
+        """Return a user's most recent jobs, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE user = ? ORDER BY created_at DESC LIMIT ?", (user, limit)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def queue_position(self, job_id):
+        """Return the number of queued jobs ahead of a queued job."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < "
+                "(SELECT created_at FROM jobs WHERE id = ?)", (QUEUED, job_id)
+            ).fetchone()[0]
+
+    def claim(self, max_running=MAX_CONCURRENT_JOBS, max_per_user=MAX_JOBS_PER_USER):
+        """
+        Mark the oldest runnable queued job as running and return it.
+
+        A job is runnable if fewer than `max_running` jobs are running overall and
+        fewer than `max_per_user` for its user.
+
+        Returns:
+            dict | None: The claimed job, or None if nothing can run now
+        """
+        with self._lock:
+            running = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+            if running >= max_running:
+                return None
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND user NOT IN "
+                "(SELECT user FROM jobs WHERE status = ? GROUP BY user HAVING COUNT(*) >= ?) "
+                "ORDER BY created_at LIMIT 1", (QUEUED, RUNNING, max_per_user)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                               (RUNNING, time.time(), row["id"]))
+            self._conn.commit()
+        return {**self._to_dict(row), "status": RUNNING}
+
+    def update(self, job_id, **fields):
+        """Update a job's fields (JSON fields are serialized)."""
+        fields = {name: json.dumps(value) if name in _JSON_FIELDS else value for name, value in fields.items()}
+        fields["updated_at"] = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+            self._conn.commit()
+
+    def statuses(self):
+        """Return job ID -> status for every job."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT id, status FROM jobs").fetchall())
+
+    def requeue_running(self):
+        """Put jobs left running by a previous server process back in the queue. Returns how many."""
+        with self._lock:
+            count = self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = 0, hazards = '{}', errors = '[]', updated_at = ? "
+                "WHERE status = ?", (QUEUED, time.time(), RUNNING)
+            ).rowcount
+            self._conn.commit()
+        return count
+
+# Shared API semaphore and job store, set in each worker process by _init_worker
+_api_limiter = None
+_store = None
+
+def _init_worker(api_limiter, jobs_path):
+    """Process pool initializer: keep the shared semaphore, open the job store and quiet Streamlit's bare-mode warnings."""
+    global _api_limiter, _store
+    from pipeline import quiet_streamlit
+    _api_limiter = api_limiter
+    _store = JobStore(jobs_path)
+    quiet_streamlit()
+
+def run_job(job_id):
+    """
+    Run the hazard pipeline for a job in a worker process, recording progress on the job.
+
+    Args:
+        job_id (str): ID of a claimed job
+    """
+    # Imported here so the Streamlit process doesn't load the pipeline just to queue jobs
+    from context_cache import get_context_cache
+    from metrics import METRICS, diff
+    from pipeline import draw_boxes, process_video
+    from prefilter import Prefilter, get_detector
+    from preprocess import UploadPreprocessor
+    from rate_limiter import get_rate_limiter
+    from rescan import Rescan, get_baseline_store
+    from response_cache import get_response_cache
+
+    job = _store.get(job_id)
+    settings = job["settings"]
+    preprocessor = UploadPreprocessor(**settings["upload"])
+    prefilter = Prefilter(get_detector()) if settings["prefilter"] else None
+    # Re-scans of a named room only analyze the keyframes that changed since its last scan
+    room = settings.get("room")
+    rescan = Rescan(get_baseline_store().latest(room)) if room else None
+    preview_path = os.path.join(os.path.dirname(job["output_path"]), "preview.jpg")
+    start_time = time.perf_counter()
+    metrics_before = METRICS.snapshot()
+    frame_count = keyframes = 0
+    hazards, errors = {}, []
+    # Streamed boxes update the hazards and preview before their keyframe is finished. Worker
+    # threads report them, so the hazards, the preview and this map are only touched under the lock
+    live_lock = threading.Lock()
+    streamed = {}  # keyframe index -> (labels counted from its streamed boxes, upright pixels with them drawn)
+
+    def count_hazard(label, index, delta):
+        first, count = hazards.get(label, (index, 0))
+        if count + delta <= 0:
+            hazards.pop(label, None)
+        else:
+            hazards[label] = (min(first, index), count + delta)
+
+    def write_preview(pixels):
+        # Replace the preview atomically so the page never reads a half-written image
+        cv2.imwrite(f"{preview_path}.part.jpg", pixels)
+        os.replace(f"{preview_path}.part.jpg", preview_path)
+
+    def on_box(frame, box):
+        with live_lock:
+            if frame.index not in streamed:
+                streamed[frame.index] = (set(), frame.upright().pixels.copy())
+            labels, pixels = streamed[frame.index]
+            draw_boxes(pixels, [box])
+            write_preview(pixels)
+            label = box.get('label', 'hazard')
+            if label not in labels:
+                labels.add(label)
+                count_hazard(label, frame.index, 1)
+            _store.update(job_id, hazards=hazards, preview_path=preview_path)
+
+    try:
+        for frame, boxes in process_video(job["video_path"], job["output_path"], preprocessor=preprocessor,
+                                          frame_budget=settings["frame_budget"],
+                                          max_in_flight=min(settings["max_in_flight"], MAX_IN_FLIGHT_PER_USER),
+                                          batch_size=settings["batch_size"], track_boxes=settings["track_boxes"],
+                                          on_error=errors.append, api_limiter=_api_limiter, prefilter=prefilter,
+                                          rescan=rescan, on_box=on_box):
+            frame_count += 1
+            # Only keyframes bring new detections; tracked frames in between are left to the final video
+            if not frame.keyframe:
+                continue
+            keyframes += 1
+            with live_lock:
+                # Settle the labels already counted while streaming with the keyframe's final boxes
+                # (a stream that failed part way leaves none)
+                counted, _ = streamed.pop(frame.index, (set(), None))
+                labels = {box.get('label', 'hazard') for box in boxes}
+                for label in labels - counted:
+                    count_hazard(label, frame.index, 1)
+                for label in counted - labels:
+                    count_hazard(label, frame.index, -1)
+                write_preview(frame.pixels)
+                _store.update(job_id, progress=keyframes, hazards=hazards, errors=errors, preview_path=preview_path)
+    except ValueError as e:
+        _store.update(job_id, status=FAILED, error=str(e), errors=errors)
+        shutil.rmtree(os.path.dirname(job["output_path"]), ignore_errors=True)
+        return
+    except (OSError, RuntimeError) as e:
+        _store.update(job_id, status=FAILED, error=f"Error encoding the annotated video: {e}", errors=errors)
+        shutil.rmtree(os.path.dirname(job["output_path"]), ignore_errors=True)
+        return
+    finally:
+        if os.path.exists(job["video_path"]):
+            os.unlink(job["video_path"])
+    # The preview is only shown while the job runs
+    if os.path.exists(preview_path):
+        os.unlink(preview_path)
+
+    rescan_summary = None
+    if rescan:
+        rescan_summary = {
+            "baseline_time": rescan.baseline.created_at if rescan.baseline else None,
+            "carried_over": rescan.carried_over,
+            "analyzed": rescan.analyzed,
+            "diff": rescan.hazard_diff(),
+        }
+        # A scan with failed requests would carry wrong (empty) detections forward, so it doesn't become the baseline
+        if not errors and rescan.size:
+            get_baseline_store().save(room, rescan.size, rescan.keyframes())
+
+    _store.update(job_id, status=DONE, progress=keyframes, hazards=hazards, errors=errors, result={
+        "keyframes": keyframes,
+        "frames": frame_count,
+        "requests": preprocessor.requests,
+        "frames_uploaded": preprocessor.frames_uploaded,
+        "bytes_uploaded": preprocessor.bytes_uploaded,
+        "prefilter": prefilter.stats() if prefilter else None,
+        "rescan": rescan_summary,
+        "seconds": time.perf_counter() - start_time,
+        # This worker runs one job at a time, so the difference is this job's alone
+        "metrics": diff(METRICS.snapshot(), metrics_before),
+        # State of this worker process's caches and limiter, which outlive the job
+        "cache": get_response_cache().stats(),
+        "context_cache": get_context_cache().stats(),
+        "limiter": get_rate_limiter().stats(),
+    })
+
+class JobRunner:
+    """
+    Dispatches queued jobs to a pool of worker processes.
+
+    A background thread claims runnable jobs whenever a worker is free, either when
+    woken by `submit()` or every DISPATCH_INTERVAL_SECONDS. Creating the runner
+    requeues interrupted jobs and sweeps the scratch directory, so the page creates
+    it on every load rather than on the first upload.
+    """
+
+    def __init__(self, store, jobs_path=JOBS_PATH, max_jobs=MAX_CONCURRENT_JOBS,
+                 max_in_flight=MAX_IN_FLIGHT_TOTAL, jobs_dir=JOBS_DIR, quota=QUOTA_BYTES):
+        self.store = store
+        self.max_jobs = max_jobs
+        self.jobs_dir = jobs_dir
+        self.quota = quota
+        self._space_lock = threading.Lock()
+        requeued = store.requeue_running()
+        if requeued:
+            print(f"Requeued {requeued} interrupted jobs")
+        # Nothing runs yet: clear out what a crashed or killed server left behind
+        removed = sweep(jobs_dir, {job_id: status == QUEUED for job_id, status in store.statuses().items()})
+        if removed:
+            print(f"Removed {removed} orphaned scratch files")
+        self.free_space()
+        # Spawned workers avoid forking a process that already has HTTP client threads
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(max_workers=max_jobs, mp_context=context, initializer=_init_worker,
+                                             initargs=(context.BoundedSemaphore(max_in_flight), jobs_path))
+        self._wake = threading.Event()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def submit(self, user, key, settings, video_path, output_path, job_id=None):
+        """Queue a job (see JobStore.submit) and wake the dispatcher. Returns the job ID."""
+        job_id = self.store.submit(user, key, settings, video_path, output_path, job_id)
+        self._wake.set()
+        self.free_space()
+        return job_id
+
+    def free_space(self):
+        """Evict finished jobs' files, least recently viewed first, until the scratch directory fits its quota."""
+        finished = {job_id for job_id, status in self.store.statuses().items() if status in (DONE, FAILED)}
+        with self._space_lock:
+            freed = enforce_quota(self.jobs_dir, finished, self.quota)
+        if freed:
+            print(f"Evicted {freed / 1e6:.0f} MB of old job outputs")
+
+    def _dispatch(self):
+        while True:
+            job = self.store.claim(self.max_jobs)
+            if job is None:
+                self._wake.wait(DISPATCH_INTERVAL_SECONDS)
+                self._wake.clear()
+                continue
+            future = self._executor.submit(run_job, job["id"])
+            future.add_done_callback(lambda future, job_id=job["id"]: self._on_done(job_id, future))
+
+    def _on_done(self, job_id, future):
+        # run_job records its own outcome; this catches workers that crashed or raised unexpectedly
+        error = future.exception()
+        if error is not None:
+            print(f"Job {job_id} failed: {error}")
+            self.store.update(job_id, status=FAILED, error=str(error) or type(error).__name__)
+        else:
+            # Fold the worker's stage timings into this process's totals, served at /metrics
+            job = self.store.get(job_id)
+            if job["result"]:
+                METRICS.merge(job["result"]["metrics"])
+        self._wake.set()
+        self.free_space()
+
+@st.cache_resource
+def get_job_store():
+    """Return the process-wide job store."""
+    return JobStore()
+
+@st.cache_resource
+def get_job_runner():
+    """Return the process-wide job runner, starting its worker pool on first use."""
+    return JobRunner(get_job_store())
@@ -0,0 +1,101 @@
+"""
+Incremental parsing of a streamed JSON array.
+Text chunks are fed in as they arrive and every top-level element is returned as
+soon as its closing brace (or the comma after it) has been received, so a caller
+can act on the first boxes of a response while the rest is still being generated.
+"""
+
+import json
+
+class JsonArrayParser:
+    """
+    Incremental parser for a single top-level JSON array.
+
+    Only the characters received since the last call are scanned, tracking
+    nesting depth and string state; each completed element is decoded once.
+    Text before the opening bracket (e.g. a Markdown fence) is skipped.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0             # Next character of the buffer to scan
+        self._depth = 0           # Bracket/brace nesting depth (1 inside the top-level array)
+        self._in_string = False
+        self._escaped = False
+        self._element_start = None
+        self.done = False         # Set once the closing bracket of the array has been seen
+
+    def feed(self, text):
+        """
+        Add a chunk of the response.
+
+        Args:
+            text (str): The next chunk of text
+
+        Returns:
+            list: Elements of the array completed by this chunk, in order
+
+        Raises:
+            json.JSONDecodeError: If a completed element is not valid JSON
+        """
+        self._buffer += text
+        elements = []
+        buffer = self._buffer
+        for pos in range(self._pos, len(buffer)):
+            if self.done:
+                break
+            char = buffer[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0:
+                if char == "[":
+                    self._depth = 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                self._finish_element(buffer, pos, elements)
+                continue
+
+            if self._depth == 0:
+                # Closing bracket of the array ends the last element
+                self._finish_element(buffer, pos, elements)
+                self.done = True
+            elif self._element_start is None and not char.isspace():
+                self._element_start = pos
+
+        # Keep only the unfinished element (or nothing) in the buffer
+        keep_from = self._element_start if self._element_start is not None else len(buffer)
+        self._buffer = buffer[keep_from:]
+        if self._element_start is not None:
+            self._element_start = 0
+        self._pos = len(self._buffer)
+        return elements
+
+    def close(self):
+        """
+        Check that the whole array was received, once the response has ended.
+
+        Raises:
+            json.JSONDecodeError: If the closing bracket never arrived (e.g. the response
+                was cut off), in which case the last element may be missing
+        """
+        if not self.done:
+            raise json.JSONDecodeError("Unterminated JSON array", self._buffer, len(self._buffer))
+
+    def _finish_element(self, buffer, end, elements):
+        if self._element_start is not None:
+            elements.append(json.loads(buffer[self._element_start:end]))
+            self._element_start = None
@@ -0,0 +1,118 @@
+"""
+Scene-change keyframe selection for room videos.
+Instead of sampling at a fixed rate, a frame is kept when it looks sufficiently
+different from the last kept frame, within a minimum and maximum frame gap and a
+per-video frame budget that is spread over the whole video.
+"""
+
+import math
+
+import cv2
+
+NOVELTY_THRESHOLD = 0.5    # Bhattacharyya histogram distance that counts as a new view
+MIN_GAP_SECONDS = 0.5      # Never keep two frames closer than this
+MAX_GAP_SECONDS = 2.0      # Always keep a frame at least this often
+FRAME_BUDGET = 60          # Maximum number of keyframes per video
+MAX_KEYFRAMES_PER_SECOND = 1.0  # Budget cap from the video's duration: never more than fixed 1 FPS sampling
+FORCED_SHARE = 0.5         # Largest share of the budget spent on keyframes kept only for the maximum gap
+BUDGET_SLACK = 0.1         # Share of the budget that may be spent ahead of pace before the threshold rises
+
+def frame_histogram(frame_bgr):
+    """
+    Compute a normalized hue/saturation histogram of a downscaled frame.
+
+    Args:
+        frame_bgr (np.ndarray): Frame in OpenCV BGR order
+
+    Returns:
+        np.ndarray: The flattened, normalized histogram
+    """
+    small = cv2.resize(frame_bgr, (64, 64), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+class KeyframeSelector:
+    """
+    Stateful keyframe selector, fed one frame index at a time.
+
+    Frames closer than `min_gap` to the last keyframe are rejected without
+    looking at their pixels, frames `max_gap` or more after it are always kept,
+    and in between a frame is kept when its histogram distance to the last
+    keyframe reaches the novelty threshold. When the total frame count is known
+    the budget is capped at MAX_KEYFRAMES_PER_SECOND of the video's duration, so
+    short videos never send more frames than fixed-rate sampling would, the
+    maximum gap is widened so that forced keyframes use at most FORCED_SHARE
+    of the budget, and the threshold rises while keyframes are being kept faster
+    than the budget allows, so busy stretches early on don't exhaust it before
+    the end of the video.
+    """
+
+    def __init__(self, fps, total_frames=0, threshold=NOVELTY_THRESHOLD,
+                 min_gap_seconds=MIN_GAP_SECONDS, max_gap_seconds=MAX_GAP_SECONDS,
+                 budget=FRAME_BUDGET):
+        self.threshold = threshold
+        self.budget = budget
+        if budget and total_frames > 0:
+            self.budget = min(budget, max(1, math.ceil(total_frames / fps * MAX_KEYFRAMES_PER_SECOND)))
+        self.total_frames = total_frames
+        self.max_gap = max(1, round(fps * max_gap_seconds))
+        self.min_gap = min(self.max_gap, max(1, round(fps * min_gap_seconds)))
+        if self.budget and total_frames > 0:
+            self.max_gap = max(self.max_gap, math.ceil(total_frames / (self.budget * FORCED_SHARE)))
+        self.selected = 0
+        self._last_idx = None
+        self._last_hist = None
+
+    def wants(self, frame_idx):
+        """Return whether frame `frame_idx` is a keyframe candidate worth decoding."""
+        if self.budget and self.selected >= self.budget:
+            return False
+        return self._last_idx is None or frame_idx - self._last_idx >= self.min_gap
+
+    def current_threshold(self, frame_idx):
+        """
+        Return the novelty threshold for a candidate frame.
+
+        While the selector is on or behind an even spread of the budget over the
+        video this is the base threshold. Keyframes kept ahead of pace use up a
+        slack of BUDGET_SLACK of the budget, and the threshold rises towards the
+        largest possible distance as the slack runs out; past it only the maximum
+        gap keeps frames until the pace catches up. Enough of the budget is always
+        left for the maximum-gap keyframes up to the end of the video.
+        """
+        if not (self.budget and self.total_frames > 0):
+            return self.threshold
+        pace = self.budget * (min(frame_idx, self.total_frames) + 1) / self.total_frames
+        slack = max(1.0, self.budget * BUDGET_SLACK)
+        spare = pace + slack - (self.selected + 1)
+        forced_left = math.ceil(max(0, self.total_frames - frame_idx - 1) / self.max_gap)
+        if spare < 0 or self.selected + 1 + forced_left > self.budget:
+            return math.inf
+        used = max(0.0, 1 - spare / slack)
+        return self.threshold + (1 - self.threshold) * used ** 2
+
+    def is_keyframe(self, frame_idx, frame_bgr):
+        """
+        Decide whether a candidate frame is kept, updating the selector state.
+
+        Args:
+            frame_idx (int): Index of the frame in the video
+            frame_bgr (np.ndarray): Decoded frame in OpenCV BGR order
+
+        Returns:
+            bool: True if the frame should be analyzed
+        """
+        if not self.wants(frame_idx):
+            return False
+        hist = frame_histogram(frame_bgr)
+        keep = (
+            self._last_idx is None
+            or frame_idx - self._last_idx >= self.max_gap
+            or cv2.compareHist(self._last_hist, hist, cv2.HISTCMP_BHATTACHARYYA) >= self.current_threshold(frame_idx)
+        )
+        if keep:
+            self._last_idx = frame_idx
+            self._last_hist = hist
+            self.selected += 1
+        return keep
@@ -0,0 +1,214 @@
+"""
+Lightweight per-stage timing and token-usage metrics for the hazard pipeline.
+Stages are timed with `stage()` blocks and Gemini token counts are read from each
+response's usage_metadata. Totals are process-wide and can be exported as a JSON
+summary or Prometheus text; a run's own breakdown is the difference between two
+snapshots. Set PIPELINE_METRICS=0 to turn collection off, in which case `stage()`
+returns a shared no-op context manager.
+"""
+
+import contextlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.getenv("PIPELINE_METRICS", "1") != "0"
+
+# usage_metadata fields -> token counter names
+TOKEN_FIELDS = {
+    "prompt_token_count": "prompt",
+    "candidates_token_count": "output",
+    "cached_content_token_count": "cached",
+    "total_token_count": "total",
+}
+
+_NULL_STAGE = contextlib.nullcontext()
+
+class _Stage:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    """
+    Thread-safe stage timers and token counters.
+
+    Stage times are summed over all threads, so concurrent stages (e.g. model
+    requests) can add up to more than the wall-clock time of a run.
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self._stages = {}   # name -> [count, total seconds, max seconds]
+        self._tokens = dict.fromkeys(TOKEN_FIELDS.values(), 0)
+        self._responses = 0
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Return a context manager that times one occurrence of a stage."""
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def observe(self, name, seconds):
+        """Record one occurrence of a stage that took `seconds`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                self._stages[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def add_usage(self, usage_metadata):
+        """Add the token counts of one Gemini response (its usage_metadata, may be None)."""
+        if not self.enabled or usage_metadata is None:
+            return
+        with self._lock:
+            self._responses += 1
+            for field, name in TOKEN_FIELDS.items():
+                self._tokens[name] += getattr(usage_metadata, field, None) or 0
+
+    def merge(self, summary):
+        """Add a snapshot or run summary recorded elsewhere, e.g. by a worker process."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for name, stage in summary["stages"].items():
+                entry = self._stages.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += stage["count"]
+                entry[1] += stage["seconds"]
+                entry[2] = max(entry[2], stage["max_seconds"])
+            for kind, count in summary["tokens"].items():
+                self._tokens[kind] = self._tokens.get(kind, 0) + count
+            self._responses += summary["responses"]
+
+    def snapshot(self):
+        """
+        Return the current totals.
+
+        Returns:
+            dict: {"stages": {name: {"count", "seconds", "max_seconds"}}, "tokens": {...}, "responses": int}
+        """
+        with self._lock:
+            return {
+                "stages": {
+                    name: {"count": count, "seconds": total, "max_seconds": longest}
+                    for name, (count, total, longest) in self._stages.items()
+                },
+                "tokens": dict(self._tokens),
+                "responses": self._responses,
+            }
+
+    def to_prometheus(self):
+        """Return the totals in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP safenest_stage_seconds_total Time spent in each pipeline stage, summed over threads.",
+            "# TYPE safenest_stage_seconds_total counter",
+        ]
+        lines += [f'safenest_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}'
+                  for name, stage in sorted(snapshot["stages"].items())]
+        lines += [
+            "# HELP safenest_stage_calls_total Number of times each pipeline stage ran.",
+            "# TYPE safenest_stage_calls_total counter",
+        ]
+        lines += [f'safenest_stage_calls_total{{stage="{name}"}} {stage["count"]}'
+                  for name, stage in sorted(snapshot["stages"].items())]
+        lines += [
+            "# HELP safenest_tokens_total Gemini tokens reported in usage_metadata.",
+            "# TYPE safenest_tokens_total counter",
+        ]
+        lines += [f'safenest_tokens_total{{kind="{kind}"}} {count}' for kind, count in snapshot["tokens"].items()]
+        lines += [
+            "# HELP safenest_responses_total Gemini responses with usage metadata.",
+            "# TYPE safenest_responses_total counter",
+            f"safenest_responses_total {snapshot['responses']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+def diff(after, before):
+    """
+    Return the metrics recorded between two snapshots, e.g. for a single run.
+
+    Max durations can't be split by run, so the later snapshot's are kept.
+    """
+    stages = {}
+    for name, stage in after["stages"].items():
+        earlier = before["stages"].get(name, {"count": 0, "seconds": 0.0})
+        if stage["count"] > earlier["count"]:
+            stages[name] = {
+                "count": stage["count"] - earlier["count"],
+                "seconds": stage["seconds"] - earlier["seconds"],
+                "max_seconds": stage["max_seconds"],
+            }
+    return {
+        "stages": stages,
+        "tokens": {kind: count - before["tokens"].get(kind, 0) for kind, count in after["tokens"].items()},
+        "responses": after["responses"] - before["responses"],
+    }
+
+def combine(summaries):
+    """Add up several snapshots or run summaries, e.g. from different worker processes."""
+    stages, tokens, responses = {}, dict.fromkeys(TOKEN_FIELDS.values(), 0), 0
+    for summary in summaries:
+        for name, stage in summary["stages"].items():
+            total = stages.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            total["count"] += stage["count"]
+            total["seconds"] += stage["seconds"]
+            total["max_seconds"] = max(total["max_seconds"], stage["max_seconds"])
+        for kind, count in summary["tokens"].items():
+            tokens[kind] = tokens.get(kind, 0) + count
+        responses += summary["responses"]
+    return {"stages": stages, "tokens": tokens, "responses": responses}
+
+# Process-wide metrics, shared by every module of the pipeline
+METRICS = Metrics()
+
+def stage(name):
+    """Time a stage on the process-wide metrics: `with stage("decode"): ...`."""
+    return METRICS.stage(name)
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """
+    Serve the process-wide metrics in Prometheus text format at /metrics, on a background thread.
+
+    Args:
+        port (int): Port to listen on
+        host (str): Interface to bind
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = METRICS.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,399 @@
+"""
+Streamlit-free hazard analysis pipeline for room videos.
+Keyframes are extracted, analyzed by Gemini (concurrently, optionally in batches),
+optionally tracked through the frames in between, annotated and encoded. Used by
+both the SafeNest page (app.py) and the batch command line (batch_cli.py).
+"""
+
+import contextlib
+import itertools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+import numpy as np
+from PIL import Image
+from streamlit import config as streamlit_config
+from streamlit.logger import set_log_level
+
+from image_analyzer import analyze_images, detect_boxes, stream_boxes, BOUNDING_BOX_CONFIG, MODEL_NAME
+from keyframes import FRAME_BUDGET
+from frame_extractor import iter_keyframes, iter_frames, open_video
+from tracking import propagate_boxes
+from frames import Frame, to_pil
+from video_encoder import FfmpegWriter
+from preprocess import UploadPreprocessor, boxes_to_pixels
+from prefilter import shift_boxes
+from metrics import stage
+from rate_limiter import GeminiError
+from response_cache import get_response_cache, make_key
+
+# Maximum number of Gemini requests allowed in flight at the same time
+MAX_IN_FLIGHT = 8
+# Number of frames sent together in one Gemini request
+BATCH_SIZE = 1
+# Stream single-frame responses and handle each box as soon as it is generated
+STREAM_RESPONSES = True
+
+prompt = \
+"""You are helping parents identify potential hazards in a room where young children (under 5 years old) may play.
+
+From the uploaded image, identify only realistic and significant safety risks, such as:
+
+- Items that could cause strangulation (e.g., cords, strings) or suffocation (e.g., plastic bags, pillows)
+- Sharp edges at child height
+- Exposed electrical outlets
+- Open drawers or cabinets and unstable furniture
+- Small choking hazards on the floor
+- Bottles containing liquids on the floor
+- Heavy or hot objects within child reach
+- Dangerous items within reach (e.g., knives, scissors)
+
+Output a json list where each entry contains the 2D bounding box as [ymin, xmin, ymax, xmax] in "box_2d" and a text label in "label"."""
+
+def quiet_streamlit():
+    """
+    Silence Streamlit's bare-mode warnings when the pipeline runs outside `streamlit run`.
+
+    The process-wide caches log "missing ScriptRunContext!" from every thread that
+    uses them. Streamlit resets its loggers' levels when it first parses its config,
+    so the config is loaded before they are lowered.
+    """
+    streamlit_config.get_option("logger.level")
+    set_log_level(logging.ERROR)
+
+def parse_cached_boxes(response):
+    """Decode a cached response (a JSON list of boxes), treating anything malformed as no boxes."""
+    try:
+        with stage("parse"):
+            boxes = json.loads(response)
+    except json.JSONDecodeError as e:
+        print(f"JSON decode error: {e}. TEXT: {response}")
+        return []
+    return boxes if isinstance(boxes, list) else []
+
+# Function to send image to Gemini API and get bounding boxes
+def get_bounding_boxes_from_gemini(image: Image.Image | np.ndarray | Frame, preprocessor: UploadPreprocessor = None,
+                                   on_error=print, on_box=None) -> list:
+    global prompt
+    # """
+    # Sends the image to the Gemini API and retrieves bounding boxes in frame pixels.
+    # With STREAM_RESPONSES, each box is converted (and passed to on_box) as soon as it arrives.
+    # """
+    try:
+        # Convert to an upright RGB image once, at the API boundary
+        with stage("convert"):
+            image = to_pil(image)
+        preprocessor = preprocessor or UploadPreprocessor()
+        scale = preprocessor.scale_for(image.size)
+        # Serve previously analyzed (or visually identical) frames from the response cache
+        cache = get_response_cache()
+        with stage("cache"):
+            key = make_key(image, prompt, BOUNDING_BOX_CONFIG.system_instruction, MODEL_NAME,
+                           preprocessor.cache_key())
+            response = cache.get(key)
+        if response is not None:
+            return boxes_to_pixels(parse_cached_boxes(response), image.size, scale)
+
+        # Upload a downscaled, re-encoded copy of the frame
+        upload = preprocessor.prepare(image)
+        preprocessor.count_request()
+        if STREAM_RESPONSES:
+            raw_boxes, boxes = [], []
+            for box in stream_boxes(upload.part, prompt, MODEL_NAME):
+                raw_boxes.append(box.model_dump())
+                pixel_boxes = boxes_to_pixels(raw_boxes[-1:], image.size, scale)
+                boxes += pixel_boxes
+                if on_box:
+                    for pixel_box in pixel_boxes:
+                        on_box(pixel_box)
+        else:
+            parsed = detect_boxes(upload.part, prompt, MODEL_NAME)
+            if parsed is None:
+                on_error("Error generating boxes: response did not match the bounding box schema")
+                return []
+            raw_boxes = [box.model_dump() for box in parsed]
+            boxes = boxes_to_pixels(raw_boxes, image.size, scale)
+        cache.put(key, json.dumps(raw_boxes))
+        print("\n Analyzed boxes: ", boxes)
+        return boxes
+    except GeminiError as e:
+        # Already retried; report the frame as failed rather than as having no hazards
+        on_error(f"Error generating content: {e}")
+        return []
+    except Exception as e:
+        on_error(f"Error generating boxes: {e}")
+        return []
+
+def split_batch_response(entries, num_frames):
+    """
+    Split a multi-frame response into one box list per frame.
+
+    Args:
+        entries (list[FrameBoundingBox] | None): Parsed response from analyze_images
+        num_frames (int): Number of frames sent in the request
+
+    Returns:
+        list[list[dict]] | None: Boxes per frame (without "frame_index"), or None if the
+        response didn't parse or any entry lacks a valid frame index
+    """
+    if entries is None:
+        return None
+    per_frame = [[] for _ in range(num_frames)]
+    for entry in entries:
+        if not 0 <= entry.frame_index < num_frames:
+            return None
+        per_frame[entry.frame_index].append(entry.model_dump(exclude={'frame_index'}))
+    return per_frame
+
+def get_bounding_boxes_for_batch(images: list, preprocessor: UploadPreprocessor = None, on_error=print,
+                                 on_box=None) -> list:
+    """
+    Get bounding boxes for several frames with a single Gemini request.
+
+    Cached frames are served from the response cache and only the rest are sent.
+    If the batch response can't be split back into frames, each frame is
+    analyzed on its own instead. Boxes of frames sent on their own are streamed
+    to `on_box(index of the image, box)` as they arrive.
+
+    Returns:
+        list[list[dict]]: Boxes in frame pixels for each image, in input order
+    """
+    if len(images) == 1:
+        return [get_bounding_boxes_from_gemini(images[0], preprocessor, on_error, frame_box_callback(on_box, 0))]
+    try:
+        with stage("convert"):
+            images = [to_pil(image) for image in images]
+        preprocessor = preprocessor or UploadPreprocessor()
+        cache = get_response_cache()
+        with stage("cache"):
+            keys = [make_key(image, prompt, BOUNDING_BOX_CONFIG.system_instruction, MODEL_NAME, preprocessor.cache_key())
+                    for image in images]
+            responses = [cache.get(key) for key in keys]
+        misses = [idx for idx, response in enumerate(responses) if response is None]
+
+        if len(misses) > 1:
+            uploads = [preprocessor.prepare(images[idx]) for idx in misses]
+            preprocessor.count_request()
+            entries = analyze_images([upload.part for upload in uploads], prompt, MODEL_NAME)
+            with stage("parse"):
+                per_frame = split_batch_response(entries, len(misses))
+            if per_frame is None:
+                print(f"Malformed batch response, falling back to per-frame requests. ENTRIES: {entries}")
+            else:
+                for idx, boxes in zip(misses, per_frame):
+                    responses[idx] = json.dumps(boxes)
+                    cache.put(keys[idx], responses[idx])
+
+        results = []
+        for idx, (image, response) in enumerate(zip(images, responses)):
+            if response is None:
+                results.append(get_bounding_boxes_from_gemini(image, preprocessor, on_error,
+                                                              frame_box_callback(on_box, idx)))
+            else:
+                results.append(boxes_to_pixels(parse_cached_boxes(response), image.size, preprocessor.scale_for(image.size)))
+        return results
+    except GeminiError as e:
+        on_error(f"Error generating content: {e}")
+        return [[] for _ in images]
+    except Exception as e:
+        on_error(f"Error generating boxes: {e}")
+        return [[] for _ in images]
+
+def frame_box_callback(on_box, idx):
+    """Bind an `on_box(index, box)` callback to one image of a batch, or return None without a callback."""
+    return (lambda box: on_box(idx, box)) if on_box else None
+
+def get_bounding_boxes_with_prefilter(images: list, prefilter, preprocessor: UploadPreprocessor = None,
+                                      on_error=print, api_limiter=None, on_box=None) -> list:
+    """
+    Get bounding boxes for several frames, sending only what the CPU pre-filter lets through.
+
+    Frames without candidate objects near floor level get no boxes, the others are
+    sent cropped to their region of interest and the boxes are mapped back to
+    full-frame pixels. The detector runs outside `api_limiter`, which is only held
+    around the request.
+
+    Returns:
+        list[list[dict]]: Boxes in frame pixels for each image, in input order
+    """
+    with stage("prefilter"):
+        regions = [prefilter.region_for(image) for image in images]
+    sent = [(idx, region) for idx, region in enumerate(regions) if region is not None]
+
+    def on_sent_box(sent_idx, box):
+        idx, region = sent[sent_idx]
+        on_box(idx, shift_boxes([box], region.offset)[0])
+
+    results = []
+    if sent:
+        with api_limiter or contextlib.nullcontext():
+            results = get_bounding_boxes_for_batch([region.frame for _, region in sent], preprocessor, on_error,
+                                                   on_sent_box if on_box else None)
+    results = iter(results)
+    return [shift_boxes(next(results), region.offset) if region is not None else [] for region in regions]
+
+def analyze_frames(frames, max_in_flight=MAX_IN_FLIGHT, on_frame_done=None, preprocessor=None, batch_size=BATCH_SIZE,
+                   on_error=print, api_limiter=None, prefilter=None, rescan=None, on_box=None):
+    """
+    Analyze frames concurrently with a bounded number of requests in flight.
+
+    Frames are grouped into requests of `batch_size` frames and submitted to a
+    thread pool as slots free up, so at most `max_in_flight` requests are
+    outstanding (and at most that many finished results are buffered) at any
+    time. Results are yielded in frame order.
+
+    Args:
+        frames (Iterable[Image | np.ndarray | Frame]): Frames to analyze, consumed lazily
+        max_in_flight (int): Maximum number of concurrent Gemini requests
+        on_frame_done (callable): Called once per finished frame, in completion order
+        preprocessor (UploadPreprocessor): Downscales and encodes frames before upload
+        batch_size (int): Number of frames sent per request
+        on_error (callable): Called with an error message, always from the consuming thread
+        api_limiter: Context manager held around every request, e.g. a semaphore shared
+            between processes to cap API concurrency globally
+        prefilter (Prefilter): Optional CPU pre-filter that skips empty frames and crops the rest
+        rescan (Rescan): Optional baseline scan; frames matching it take over its boxes instead of being sent
+        on_box (callable): Called with (frame, box in frame pixels) for each streamed box as soon as it
+            arrives, from the worker threads; the frame's final boxes are still yielded in order
+
+    Yields:
+        tuple: (frame, boxes) for each frame, in the original frame order
+    """
+    frames = iter(frames)
+    api_limiter = api_limiter or contextlib.nullcontext()
+    errors = []    # appended to by worker threads, reported by this one
+    pending = {}   # future -> (index of the first frame in the batch, frames in the batch)
+    finished = {}  # frame index -> (frame, boxes)
+    next_idx = 0
+    submitted = 0
+    exhausted = False
+
+    def analyze_new(batch):
+        on_batch_box = (lambda idx, box: on_box(batch[idx], box)) if on_box else None
+        if prefilter:
+            return get_bounding_boxes_with_prefilter(batch, prefilter, preprocessor, errors.append, api_limiter,
+                                                     on_batch_box)
+        with api_limiter:
+            return get_bounding_boxes_for_batch(batch, preprocessor, errors.append, on_batch_box)
+
+    def analyze_batch(batch):
+        if not rescan:
+            return analyze_new(batch)
+        # Only frames that changed since the baseline scan are analyzed
+        with stage("rescan"):
+            carried_over = [rescan.lookup(frame) for frame in batch]
+        changed = [frame for frame, boxes in zip(batch, carried_over) if boxes is None]
+        results = iter(analyze_new(changed) if changed else [])
+        batch_boxes = [next(results) if boxes is None else boxes for boxes in carried_over]
+        for frame, boxes in zip(batch, batch_boxes):
+            rescan.record(frame, boxes)
+        return batch_boxes
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        while True:
+            # Keep the window full without running too far ahead of the next frame to yield
+            while not exhausted and submitted - next_idx < max_in_flight * batch_size:
+                batch = list(itertools.islice(frames, batch_size))
+                if not batch:
+                    exhausted = True
+                    break
+                future = executor.submit(analyze_batch, batch)
+                pending[future] = (submitted, batch)
+                submitted += len(batch)
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                first_idx, batch = pending.pop(future)
+                for offset, (frame, boxes) in enumerate(zip(batch, future.result())):
+                    finished[first_idx + offset] = (frame, boxes)
+                    if on_frame_done:
+                        on_frame_done()
+            while errors:
+                on_error(errors.pop(0))
+
+            while next_idx in finished:
+                yield finished.pop(next_idx)
+                next_idx += 1
+
+def draw_boxes(frame_cv, boxes):
+    """Draw labeled bounding boxes (in frame pixels) onto a BGR frame, in place."""
+    for box in boxes:
+        if 'box_2d' in box and len(box['box_2d']) == 4:
+            ymin, xmin, ymax, xmax = box['box_2d']
+            cv2.rectangle(frame_cv, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
+            
+            label = box['label']
+            # Set font and scale
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            font_scale = 0.6
+            font_thickness = 2
+            text_size, _ = cv2.getTextSize(label, font, font_scale, font_thickness)
+
+            # Position for the label
+            label_origin = (xmin, ymin - 10)
+
+            cv2.putText(frame_cv, label, label_origin, font, font_scale, (0, 0, 0), font_thickness)
+
+def process_video(video_path, output_path=None, preprocessor=None, frame_budget=FRAME_BUDGET,
+                  max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE, track_boxes=True,
+                  on_frame_done=None, on_error=print, api_limiter=None, prefilter=None, rescan=None, on_box=None):
+    """
+    Run the full hazard pipeline on a video.
+
+    Keyframes are analyzed concurrently, boxes are optionally tracked through the
+    frames in between (at the video's frame rate, otherwise keyframes are written
+    at 1 FPS), drawn onto each frame and, if `output_path` is given, encoded to
+    an H.264 MP4 as they arrive.
+
+    Args:
+        video_path (str): Path to the input video
+        output_path (str): Where to write the annotated MP4, or None to skip encoding
+        preprocessor (UploadPreprocessor): Downscales and encodes frames before upload
+        frame_budget (int): Maximum number of keyframes sent to the model
+        max_in_flight (int): Maximum number of concurrent Gemini requests
+        batch_size (int): Number of frames sent per request
+        track_boxes (bool): Annotate every frame by tracking keyframe boxes
+        on_frame_done (callable): Called once per analyzed keyframe
+        on_error (callable): Called with error messages from the analysis
+        api_limiter: Context manager held around every request
+        prefilter (Prefilter): Optional CPU pre-filter that skips empty frames and crops the rest
+        rescan (Rescan): Optional baseline scan; keyframes matching it take over its boxes instead of being sent
+        on_box (callable): Called with (keyframe, box in upright frame pixels) as each streamed box arrives,
+            from worker threads and before the keyframe is yielded
+
+    Yields:
+        tuple: (upright Frame, boxes) for every annotated frame, in order
+
+    Raises:
+        ValueError: If the video cannot be read
+        OSError, RuntimeError: If the annotated video cannot be encoded
+    """
+    cap, fps, _, _ = open_video(video_path)
+    cap.release()
+
+    results = analyze_frames(iter_keyframes(video_path, budget=frame_budget), max_in_flight,
+                             on_frame_done=on_frame_done, preprocessor=preprocessor, batch_size=batch_size,
+                             on_error=on_error, api_limiter=api_limiter, prefilter=prefilter,
+                             rescan=rescan, on_box=on_box)
+    if track_boxes:
+        # Decode the video a second time, trailing the analysis, to fill in the frames in between
+        results = propagate_boxes(iter_frames(video_path), results)
+
+    writer = FfmpegWriter(output_path, fps if track_boxes else 1, pix_fmt="bgr24") if output_path else None
+    with writer or contextlib.nullcontext():
+        for frame, boxes in results:
+            # Rotate upright once (as the model saw it) and draw on the decoder's BGR pixels
+            frame = frame.upright()
+            with stage("draw"):
+                draw_boxes(frame.pixels, boxes)
+
+            # Encode the BGR frame straight away instead of keeping it in memory
+            if writer:
+                writer.write(frame.pixels)
+            yield frame, boxes
+
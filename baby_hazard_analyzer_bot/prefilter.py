@@ -0,0 +1,181 @@
+"""
+Optional on-CPU pre-filter in front of the cloud model.
+A small COCO object detector (a YOLO ONNX export, run with OpenCV DNN) looks at
+each keyframe first. Frames with no candidate objects near floor level are
+skipped, and the others are cropped to the region around the candidates, so the
+model only sees the part of the frame where hazards within a child's reach can be.
+
+The detector is configured with PREFILTER_MODEL (path to e.g. yolov8n.onnx); the
+cascade is unavailable without it.
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+import streamlit as st
+
+from frames import Frame
+
+MODEL_PATH = os.getenv("PREFILTER_MODEL")
+INPUT_SIZE = 320             # Detector input resolution (square)
+CONFIDENCE = 0.25            # Minimum detection score for a candidate
+NMS_THRESHOLD = 0.45
+FLOOR_LINE = 0.4             # Candidates must reach below this fraction of the frame height
+CROP_MARGIN = 0.15           # Region of interest is padded by this fraction of its size on each side
+MIN_CROP_MARGIN = 32         # ... and by at least this many pixels
+MAX_CROP_FRACTION = 0.8      # Send the whole frame when the region covers more than this of it
+
+@dataclass
+class Region:
+    """
+    What to send to the model for one frame.
+
+    Attributes:
+        frame (Frame): The upright frame, cropped to the region of interest
+        offset (tuple[int, int]): (x, y) of the crop's top-left corner in the full frame
+    """
+
+    frame: Frame
+    offset: tuple
+
+class ObjectDetector:
+    """
+    YOLO (v5 or v8 ONNX export) object detector on OpenCV DNN.
+
+    `detect()` is safe to call from several threads; inference is serialized.
+    """
+
+    def __init__(self, model_path, input_size=INPUT_SIZE, confidence=CONFIDENCE, nms_threshold=NMS_THRESHOLD):
+        self.net = cv2.dnn.readNet(model_path)
+        self.input_size = input_size
+        self.confidence = confidence
+        self.nms_threshold = nms_threshold
+        self._lock = threading.Lock()
+
+    def detect(self, frame_bgr):
+        """
+        Detect objects in a frame.
+
+        Args:
+            frame_bgr (np.ndarray): Upright BGR frame
+
+        Returns:
+            list[tuple]: (x1, y1, x2, y2) pixel boxes of the detections
+        """
+        height, width = frame_bgr.shape[:2]
+        blob = cv2.dnn.blobFromImage(frame_bgr, 1 / 255, (self.input_size, self.input_size), swapRB=True, crop=False)
+        with self._lock:
+            self.net.setInput(blob)
+            output = self.net.forward()[0]
+
+        # v8 exports are (4 + classes, N), v5 exports are (N, 5 + classes)
+        if output.shape[0] < output.shape[1]:
+            output = output.T
+        if output.shape[1] == 85:
+            scores = output[:, 4:5] * output[:, 5:]
+        else:
+            scores = output[:, 4:]
+        best = scores.max(axis=1)
+        keep = best >= self.confidence
+        if not keep.any():
+            return []
+
+        cx, cy, w, h = output[keep, :4].T
+        sx, sy = width / self.input_size, height / self.input_size
+        rects = np.stack([(cx - w / 2) * sx, (cy - h / 2) * sy, w * sx, h * sy], axis=1)
+        indices = cv2.dnn.NMSBoxes(rects.tolist(), best[keep].tolist(), self.confidence, self.nms_threshold)
+        return [
+            (int(x), int(y), int(x + w), int(y + h))
+            for x, y, w, h in (rects[i] for i in np.array(indices).flatten())
+        ]
+
+class Prefilter:
+    """
+    Decides, per keyframe, whether to skip it or which region of it to send.
+
+    Attributes:
+        frames_seen (int): Keyframes checked
+        frames_skipped (int): Keyframes with no candidate near floor level
+        pixels_seen (int): Pixels in the checked keyframes
+        pixels_sent (int): Pixels in the regions sent to the model
+    """
+
+    def __init__(self, detector, floor_line=FLOOR_LINE):
+        self.detector = detector
+        self.floor_line = floor_line
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.pixels_seen = 0
+        self.pixels_sent = 0
+        self._lock = threading.Lock()
+
+    def region_for(self, frame):
+        """
+        Return the region of a frame to send to the model.
+
+        Args:
+            frame (Frame): A keyframe
+
+        Returns:
+            Region | None: The (possibly cropped) upright frame and its offset, or None to skip the frame
+        """
+        frame = frame.upright()
+        height, width = frame.pixels.shape[:2]
+        pixels = frame.pixels if frame.color_order == "BGR" else frame.pixels[:, :, ::-1]
+        candidates = [box for box in self.detector.detect(pixels) if box[3] >= self.floor_line * height]
+
+        region = None
+        if candidates:
+            x1, y1 = min(box[0] for box in candidates), min(box[1] for box in candidates)
+            x2, y2 = max(box[2] for box in candidates), max(box[3] for box in candidates)
+            margin_x = max(MIN_CROP_MARGIN, int((x2 - x1) * CROP_MARGIN))
+            margin_y = max(MIN_CROP_MARGIN, int((y2 - y1) * CROP_MARGIN))
+            x1, y1 = max(0, x1 - margin_x), max(0, y1 - margin_y)
+            x2, y2 = min(width, x2 + margin_x), min(height, y2 + margin_y)
+            if (x2 - x1) * (y2 - y1) > MAX_CROP_FRACTION * width * height:
+                region = Region(frame, (0, 0))
+            else:
+                # A view into the frame; the pixels are copied once, when converted for upload
+                region = Region(Frame(frame.pixels[y1:y2, x1:x2], frame.index, frame.color_order, 0, frame.keyframe),
+                                (x1, y1))
+
+        with self._lock:
+            self.frames_seen += 1
+            self.pixels_seen += width * height
+            if region is None:
+                self.frames_skipped += 1
+            else:
+                self.pixels_sent += region.frame.pixels.shape[0] * region.frame.pixels.shape[1]
+        return region
+
+    def stats(self):
+        """Return the fractions of keyframes and pixels the pre-filter kept away from the model."""
+        with self._lock:
+            return {
+                "frames_seen": self.frames_seen,
+                "frames_skipped": self.frames_skipped,
+                "pixels_seen": self.pixels_seen,
+                "pixels_sent": self.pixels_sent,
+                "frames_saved": self.frames_skipped / self.frames_seen if self.frames_seen else 0.0,
+                "pixels_saved": 1 - self.pixels_sent / self.pixels_seen if self.pixels_seen else 0.0,
+            }
+
+def shift_boxes(boxes, offset):
+    """Map boxes found in a crop back to full-frame pixel coordinates."""
+    x, y = offset
+    if not x and not y:
+        return boxes
+    return [
+        {**box, "box_2d": [box["box_2d"][0] + y, box["box_2d"][1] + x, box["box_2d"][2] + y, box["box_2d"][3] + x]}
+        for box in boxes
+    ]
+
+@st.cache_resource
+def get_detector(model_path=MODEL_PATH):
+    """Return the process-wide detector for `model_path`, or None if no model is configured."""
+    if not model_path or not os.path.exists(model_path):
+        return None
+    return ObjectDetector(model_path)
@@ -0,0 +1,127 @@
+"""
+Upload preprocessing for frames sent to Gemini.
+Frames are downscaled to a maximum long side and re-encoded as JPEG or WebP before
+upload, and the boxes that come back are mapped to the original frame's pixels.
+"""
+
+import io
+import threading
+from dataclasses import dataclass
+
+from google.genai.types import Part
+from PIL import Image
+
+from metrics import stage
+
+MAX_LONG_SIDE = 1024    # Longest side of an uploaded frame, in pixels
+IMAGE_FORMAT = "JPEG"   # "JPEG" or "WEBP"
+QUALITY = 80            # Encoder quality, 1-100
+BOX_SCALE = 1000        # Gemini returns box_2d normalized to 0-1000
+
+@dataclass
+class PreparedImage:
+    """An encoded frame ready for upload, with the scale it was resized by."""
+
+    part: Part
+    scale: float
+    num_bytes: int
+
+class UploadPreprocessor:
+    """
+    Downscales and re-encodes frames before upload, and counts what was sent.
+
+    A single instance can be shared between threads.
+
+    Attributes:
+        frames_uploaded (int): Number of frames prepared for upload
+        bytes_uploaded (int): Total encoded bytes of those frames
+        requests (int): Number of requests those frames were sent in (see count_request)
+    """
+
+    def __init__(self, max_long_side=MAX_LONG_SIDE, image_format=IMAGE_FORMAT, quality=QUALITY, grayscale=False):
+        self.max_long_side = max_long_side
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.grayscale = grayscale
+        self.frames_uploaded = 0
+        self.bytes_uploaded = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def cache_key(self):
+        """Return the settings that change what the model sees, for response cache keys."""
+        return f"{self.max_long_side}:{self.image_format}:{self.quality}:{int(self.grayscale)}"
+
+    def scale_for(self, size):
+        """Return the factor a frame of `size` (width, height) is resized by; never upscales."""
+        long_side = max(size)
+        if not self.max_long_side or long_side <= self.max_long_side:
+            return 1.0
+        return self.max_long_side / long_side
+
+    def prepare(self, image):
+        """
+        Resize and encode a frame for upload.
+
+        Args:
+            image (Image): Frame to upload
+
+        Returns:
+            PreparedImage: The encoded frame as a Part, its scale and its size in bytes
+        """
+        scale = self.scale_for(image.size)
+        with stage("upload_encode"):
+            if scale < 1.0:
+                image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+            image = image.convert("L" if self.grayscale else "RGB")
+
+            buffer = io.BytesIO()
+            image.save(buffer, format=self.image_format, quality=self.quality)
+            data = buffer.getvalue()
+
+        with self._lock:
+            self.frames_uploaded += 1
+            self.bytes_uploaded += len(data)
+        return PreparedImage(
+            part=Part.from_bytes(data=data, mime_type=f"image/{self.image_format.lower()}"),
+            scale=scale,
+            num_bytes=len(data),
+        )
+
+    def count_request(self):
+        """Count one request sent with frames from this preprocessor (a batch counts once)."""
+        with self._lock:
+            self.requests += 1
+
+def boxes_to_pixels(boxes, size, scale):
+    """
+    Map boxes from the model's normalized 0-1000 space to original frame pixels.
+
+    Coordinates are first expanded to the uploaded (resized) frame and then
+    divided by the scale it was resized by.
+
+    Args:
+        boxes (list[dict]): Boxes with "box_2d" as [ymin, xmin, ymax, xmax] in 0-1000
+        size (tuple): (width, height) of the original frame
+        scale (float): Factor the frame was resized by before upload
+
+    Returns:
+        list[dict]: Copies of the valid boxes with "box_2d" in original frame pixels
+    """
+    width, height = size
+    upload_width, upload_height = round(width * scale), round(height * scale)
+    pixel_boxes = []
+    for box in boxes:
+        if not isinstance(box, dict) or len(box.get('box_2d', [])) != 4:
+            continue
+        ymin, xmin, ymax, xmax = box['box_2d']
+        pixel_boxes.append({
+            **box,
+            'box_2d': [
+                min(height, max(0, round(ymin / BOX_SCALE * upload_height / scale))),
+                min(width, max(0, round(xmin / BOX_SCALE * upload_width / scale))),
+                min(height, max(0, round(ymax / BOX_SCALE * upload_height / scale))),
+                min(width, max(0, round(xmax / BOX_SCALE * upload_width / scale))),
+            ],
+        })
+    return pixel_boxes
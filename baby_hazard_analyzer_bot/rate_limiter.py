@@ -0,0 +1,229 @@
+"""
+Retries and adaptive rate limiting for Gemini requests.
+Failures are classified into structured error types. Rate-limit and transient
+errors are retried with jittered exponential backoff that honors Retry-After,
+while a token bucket shared by all requests in the process lowers the request
+rate and concurrency when quota errors appear and raises them again once
+requests succeed.
+"""
+
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+import streamlit as st
+from google.genai import errors
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+REQUESTS_PER_SECOND = 10.0      # Starting (and maximum) request rate
+MIN_REQUESTS_PER_SECOND = 0.2   # The rate is never lowered below this
+MAX_CONCURRENCY = 32            # Starting (and maximum) number of requests in flight
+RECOVERY_REQUESTS = 50          # Successful requests needed to recover the full rate after a cut
+COOLDOWN_SECONDS = 2.0          # Quota errors within this long of a cut don't cut again
+MAX_ATTEMPTS = 6                # Attempts per request, including the first
+BACKOFF_BASE_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+class GeminiError(Exception):
+    """
+    A failed Gemini request.
+
+    Attributes:
+        retry_after (float | None): Seconds the server asked us to wait before retrying
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class RateLimitError(GeminiError):
+    """The request was rejected for exceeding the quota (HTTP 429); retried."""
+
+class TransientError(GeminiError):
+    """A timeout, connection failure or server error; retried."""
+
+class RequestError(GeminiError):
+    """Any other failure, e.g. an invalid request; not retried."""
+
+def _retry_after(error):
+    """Return the delay requested by a Retry-After header or a RetryInfo error detail, in seconds."""
+    response = getattr(error, "response", None)
+    header = response.headers.get("retry-after") if isinstance(response, httpx.Response) else None
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(header) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", details).get("details", []) or []:
+            match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", ""))) if isinstance(detail, dict) else None
+            if match:
+                return float(match.group(1))
+    return None
+
+def classify_error(error):
+    """
+    Convert an exception raised by a Gemini request into a GeminiError.
+
+    Args:
+        error (Exception): The exception raised by the SDK or the HTTP client
+
+    Returns:
+        GeminiError: RateLimitError, TransientError or RequestError
+    """
+    if isinstance(error, GeminiError):
+        return error
+    message = f"{type(error).__name__}: {error}"
+    if isinstance(error, errors.APIError):
+        if error.code == 429 or error.status == "RESOURCE_EXHAUSTED":
+            return RateLimitError(message, _retry_after(error))
+        if error.code == 408 or (error.code or 0) >= 500:
+            return TransientError(message, _retry_after(error))
+        return RequestError(message)
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return TransientError(message)
+    return RequestError(message)
+
+class AdaptiveLimiter:
+    """
+    Token bucket plus concurrency limit, adapted to quota errors.
+
+    Use as a context manager around each request attempt. A RateLimitError
+    leaving the block halves the rate and the concurrency limit (at most once
+    per cooldown); successful requests raise them again additively.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, max_concurrency=MAX_CONCURRENCY, min_rate=MIN_REQUESTS_PER_SECOND):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.concurrency = max_concurrency
+        self.retries = 0
+        self.rate_limited = 0
+        self._tokens = max(1.0, rate)
+        self._updated = time.monotonic()
+        self._last_cut = float("-inf")
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        # Allow bursts of up to one second's worth of requests
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a token and a concurrency slot are available."""
+        with self._cond:
+            while True:
+                self._refill()
+                if self._tokens >= 1 and self._in_flight < self.concurrency:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+                self._cond.wait(timeout=(1 - self._tokens) / self.rate if self._tokens < 1 else None)
+
+    def release(self, rate_limited=False):
+        """Free the slot taken by `acquire()` and adapt to the outcome of the request."""
+        with self._cond:
+            self._in_flight -= 1
+            self._refill()
+            if rate_limited:
+                self.rate_limited += 1
+                now = time.monotonic()
+                if now - self._last_cut >= COOLDOWN_SECONDS:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self.concurrency = max(1, self.concurrency // 2)
+                    self._tokens = min(self._tokens, 0.0)
+                    self._successes = 0
+                    self._last_cut = now
+            else:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / RECOVERY_REQUESTS)
+                self._successes += 1
+                if self._successes >= self.concurrency:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def record_retry(self):
+        """Count a retried request."""
+        with self._cond:
+            self.retries += 1
+
+    def stats(self):
+        """Return the current rate and concurrency limit and the retry counters."""
+        with self._cond:
+            return {
+                "rate": round(self.rate, 2),
+                "concurrency": self.concurrency,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+            }
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(rate_limited=isinstance(exc, RateLimitError))
+        return False
+
+@st.cache_resource
+def get_rate_limiter():
+    """Return the process-wide limiter shared by all Gemini requests."""
+    return AdaptiveLimiter()
+
+_backoff = wait_random_exponential(multiplier=BACKOFF_BASE_SECONDS, max=MAX_BACKOFF_SECONDS)
+
+def _wait(retry_state):
+    # Jittered exponential backoff, but never sooner than the server asked for
+    delay = _backoff(retry_state)
+    retry_after = retry_state.outcome.exception().retry_after
+    return max(delay, retry_after) if retry_after is not None else delay
+
+def call_with_retry(request, limiter=None):
+    """
+    Run a Gemini request through the limiter, retrying rate-limit and transient errors.
+
+    Args:
+        request (callable): Function making a single request attempt
+        limiter (AdaptiveLimiter): Limiter to use; the process-wide one if omitted
+
+    Returns:
+        The return value of `request`
+
+    Raises:
+        GeminiError: If the request failed with a non-retryable error or ran out of attempts
+    """
+    limiter = limiter or get_rate_limiter()
+
+    def attempt():
+        with limiter:
+            try:
+                return request()
+            except Exception as e:
+                raise classify_error(e) from e
+
+    def before_sleep(retry_state):
+        limiter.record_retry()
+        print(f"Retrying Gemini request in {retry_state.next_action.sleep:.1f}s "
+              f"(attempt {retry_state.attempt_number} failed: {retry_state.outcome.exception()})")
+
+    retrying = Retrying(
+        stop=stop_after_attempt(MAX_ATTEMPTS),
+        wait=_wait,
+        retry=retry_if_exception_type((RateLimitError, TransientError)),
+        before_sleep=before_sleep,
+        reraise=True,
+    )
+    return retrying(attempt)
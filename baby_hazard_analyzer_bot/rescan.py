@@ -0,0 +1,298 @@
+"""
+Incremental re-scans of a room against its previous scan.
+Each scan of a room stores the perceptual hash (dHash) of every keyframe together
+with the boxes found in it. When the room is scanned again, keyframes that closely
+match a keyframe of the previous scan take over its boxes and only the rest are
+sent to the model. The report compares the two scans' hazards by position within
+keyframes of the same view, since the model rarely words a label the same way twice,
+and falls back to labels where there is no such view.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+import streamlit as st
+
+BASELINE_PATH = os.getenv(
+    "BASELINE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "baselines.sqlite3"),
+)
+HASH_SIZE = 16        # dHash grid, HASH_SIZE**2 bits
+MATCH_DISTANCE = 24   # Keyframes at most this many bits apart count as unchanged
+VIEW_DISTANCE = 64    # Keyframes at most this many bits apart show the same view, changed or not
+IOU_MATCH = 0.3       # Boxes in the same view overlapping at least this much are the same hazard
+MAX_SCANS = 10        # Scans kept per room
+
+def frame_hash(frame):
+    """
+    Compute the difference hash (dHash) of a frame.
+
+    Args:
+        frame (Frame): Frame to hash
+
+    Returns:
+        np.ndarray: The hash as HASH_SIZE**2 / 8 packed bytes
+    """
+    upright = frame.upright()
+    gray = cv2.cvtColor(upright.pixels, cv2.COLOR_BGR2GRAY if upright.color_order == "BGR" else cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+@dataclass
+class Scan:
+    """
+    A stored scan of a room.
+
+    Attributes:
+        id (int): Scan ID
+        room (str): Room name
+        created_at (float): Unix time of the scan
+        size (tuple[int, int]): (width, height) of the upright keyframes
+        hashes (np.ndarray): K x (HASH_SIZE**2 / 8) keyframe hashes
+        boxes (list[list[dict]]): Boxes in frame pixels for each keyframe
+    """
+
+    id: int
+    room: str
+    created_at: float
+    size: tuple
+    hashes: np.ndarray
+    boxes: list
+
+class BaselineStore:
+    """
+    SQLite-backed scans per room, keeping the last MAX_SCANS of each.
+
+    A single instance can be shared between threads.
+    """
+
+    def __init__(self, path=BASELINE_PATH, max_scans=MAX_SCANS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_scans = max_scans
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY,
+                room TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS keyframes (
+                scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+                frame_index INTEGER NOT NULL,
+                hash BLOB NOT NULL,
+                boxes TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scans_room ON scans (room, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS keyframes_scan ON keyframes (scan_id)")
+        self._conn.commit()
+
+    def latest(self, room):
+        """Return the most recent scan of a room, or None if it was never scanned."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created_at, width, height FROM scans WHERE room = ? ORDER BY created_at DESC LIMIT 1",
+                (room,),
+            ).fetchone()
+            if row is None:
+                return None
+            keyframes = self._conn.execute(
+                "SELECT hash, boxes FROM keyframes WHERE scan_id = ? ORDER BY frame_index", (row[0],)
+            ).fetchall()
+        hashes = np.array([np.frombuffer(hashed, dtype=np.uint8) for hashed, _ in keyframes], dtype=np.uint8)
+        return Scan(row[0], room, row[1], (row[2], row[3]), hashes.reshape(len(keyframes), -1),
+                    [json.loads(boxes) for _, boxes in keyframes])
+
+    def save(self, room, size, keyframes):
+        """
+        Store a scan of a room, dropping its oldest scans above the cap.
+
+        Args:
+            room (str): Room name
+            size (tuple[int, int]): (width, height) of the upright keyframes
+            keyframes (list[tuple]): (frame index, hash, boxes in frame pixels) for each keyframe
+
+        Returns:
+            int: The scan ID
+        """
+        with self._lock:
+            scan_id = self._conn.execute(
+                "INSERT INTO scans (room, created_at, width, height) VALUES (?, ?, ?, ?)",
+                (room, time.time(), size[0], size[1]),
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO keyframes (scan_id, frame_index, hash, boxes) VALUES (?, ?, ?, ?)",
+                [(scan_id, index, hashed.tobytes(), json.dumps(boxes)) for index, hashed, boxes in keyframes],
+            )
+            self._conn.execute(
+                "DELETE FROM scans WHERE room = ? AND id NOT IN "
+                "(SELECT id FROM scans WHERE room = ? ORDER BY created_at DESC LIMIT ?)",
+                (room, room, self.max_scans),
+            )
+            self._conn.commit()
+        return scan_id
+
+    def rooms(self):
+        """Return the names of all scanned rooms."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT room FROM scans ORDER BY room")]
+
+def scale_boxes(boxes, from_size, to_size):
+    """Rescale pixel boxes from frames of `from_size` to frames of `to_size` (both (width, height))."""
+    if tuple(from_size) == tuple(to_size):
+        return boxes
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    return [
+        {**box, "box_2d": [round(box["box_2d"][0] * sy), round(box["box_2d"][1] * sx),
+                           round(box["box_2d"][2] * sy), round(box["box_2d"][3] * sx)]}
+        for box in boxes
+    ]
+
+def box_iou(first, second):
+    """Return the intersection over union of two [ymin, xmin, ymax, xmax] boxes."""
+    height = min(first[2], second[2]) - max(first[0], second[0])
+    width = min(first[3], second[3]) - max(first[1], second[1])
+    if height <= 0 or width <= 0:
+        return 0.0
+    intersection = height * width
+    area = (first[2] - first[0]) * (first[3] - first[1]) + (second[2] - second[0]) * (second[3] - second[1])
+    return intersection / (area - intersection)
+
+def normalize_label(box):
+    """Return a box's label in the form labels are compared in."""
+    return box.get("label", "hazard").strip().lower()
+
+class Rescan:
+    """
+    Matches the keyframes of a new scan against a baseline scan and collects the new scan.
+
+    Attributes:
+        baseline (Scan | None): Previous scan of the room, or None for a first scan
+        carried_over (int): Keyframes whose boxes were taken from the baseline
+        analyzed (int): Keyframes that had to be analyzed
+    """
+
+    def __init__(self, baseline, match_distance=MATCH_DISTANCE, view_distance=VIEW_DISTANCE):
+        self.baseline = baseline
+        self.match_distance = match_distance
+        self.view_distance = view_distance
+        self.carried_over = 0
+        self.analyzed = 0
+        self.size = None
+        self._keyframes = {}  # frame index -> (hash, boxes)
+        self._views = {}      # frame index -> index of the baseline keyframe showing the same view
+        self._lock = threading.Lock()
+
+    def lookup(self, frame):
+        """
+        Return the baseline's boxes for a frame that hasn't changed, or None if it must be analyzed.
+
+        Args:
+            frame (Frame): A keyframe of the new scan
+
+        Returns:
+            list[dict] | None: Boxes in the frame's upright pixels, or None
+        """
+        hashed = frame_hash(frame)
+        boxes = view = None
+        if self.baseline is not None and len(self.baseline.hashes):
+            distances = np.unpackbits(self.baseline.hashes ^ hashed, axis=1).sum(axis=1)
+            nearest = int(distances.argmin())
+            if distances[nearest] <= self.match_distance:
+                boxes = scale_boxes(self.baseline.boxes[nearest], self.baseline.size, frame.size)
+            if distances[nearest] <= self.view_distance:
+                view = nearest
+        with self._lock:
+            self.size = frame.size
+            self._keyframes[frame.index] = (hashed, None)
+            if view is not None:
+                self._views[frame.index] = view
+            if boxes is None:
+                self.analyzed += 1
+            else:
+                self.carried_over += 1
+        return boxes
+
+    def record(self, frame, boxes):
+        """Record the boxes of a looked-up keyframe for the new scan."""
+        with self._lock:
+            self._keyframes[frame.index] = (self._keyframes[frame.index][0], boxes)
+
+    def keyframes(self):
+        """Return the new scan's (frame index, hash, boxes) records, in frame order."""
+        with self._lock:
+            return [(index, hashed, boxes) for index, (hashed, boxes) in sorted(self._keyframes.items())
+                    if boxes is not None]
+
+    def hazard_diff(self):
+        """
+        Compare the hazards of the new scan with the baseline's.
+
+        Within each new keyframe that shows the same view as a baseline keyframe, boxes
+        overlapping by at least IOU_MATCH (greedily, best overlap first) are the same
+        hazard, whatever their labels. Boxes left over on either side are then matched
+        by label. Labels are reported as the new scan words them.
+
+        Returns:
+            dict: Sorted "new", "resolved" and "unchanged" hazard labels
+        """
+        with self._lock:
+            views = dict(self._views)
+        current = [(index, box) for index, _, boxes in self.keyframes() for box in boxes]
+        previous = [(index, box) for index, boxes in enumerate(self.baseline.boxes if self.baseline else [])
+                    for box in boxes]
+        matched_current, matched_previous = set(), set()
+
+        # Same hazard by position, within keyframes of the same view
+        pairs = []
+        for current_idx, (index, box) in enumerate(current):
+            if index not in views:
+                continue
+            for previous_idx, (baseline_index, baseline_box) in enumerate(previous):
+                if baseline_index != views[index]:
+                    continue
+                rescaled = scale_boxes([baseline_box], self.baseline.size, self.size)[0]
+                iou = box_iou(box["box_2d"], rescaled["box_2d"])
+                if iou >= IOU_MATCH:
+                    pairs.append((iou, current_idx, previous_idx))
+        for _, current_idx, previous_idx in sorted(pairs, reverse=True):
+            if current_idx not in matched_current and previous_idx not in matched_previous:
+                matched_current.add(current_idx)
+                matched_previous.add(previous_idx)
+
+        # Same hazard by label, for boxes without a match in the same view
+        unmatched_previous_labels = {normalize_label(box) for idx, (_, box) in enumerate(previous)
+                                     if idx not in matched_previous}
+        unmatched_current_labels = {normalize_label(box) for idx, (_, box) in enumerate(current)
+                                    if idx not in matched_current}
+        matched_current.update(idx for idx, (_, box) in enumerate(current)
+                               if normalize_label(box) in unmatched_previous_labels)
+        matched_previous.update(idx for idx, (_, box) in enumerate(previous)
+                                if normalize_label(box) in unmatched_current_labels)
+
+        unchanged = {normalize_label(box) for idx, (_, box) in enumerate(current) if idx in matched_current}
+        new = {normalize_label(box) for idx, (_, box) in enumerate(current) if idx not in matched_current}
+        resolved = {normalize_label(box) for idx, (_, box) in enumerate(previous) if idx not in matched_previous}
+        return {
+            "new": sorted(new - unchanged),
+            "resolved": sorted(resolved),
+            "unchanged": sorted(unchanged),
+        }
+
+@st.cache_resource
+def get_baseline_store():
+    """Return the process-wide baseline store."""
+    return BaselineStore()
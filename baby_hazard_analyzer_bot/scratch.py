@@ -0,0 +1,123 @@
+"""
+Disk management for the job scratch directory.
+Uploads are copied and hashed in fixed-size chunks, every job keeps its files in a
+directory of its own, finished jobs are evicted least recently viewed first once
+the directory exceeds its quota, and a sweep when the job runner is created (on
+the first page load after the server starts) removes files that no job owns
+(e.g. after a crash), so a long-running server's disk use stays bounded.
+"""
+
+import hashlib
+import os
+import shutil
+
+CHUNK_SIZE = 1 << 20
+QUOTA_BYTES = int(os.getenv("SCRATCH_QUOTA_MB", "2048")) * 1024 * 1024
+
+def hash_upload(upload, chunk_size=CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file object's contents, read in chunks from the start."""
+    digest = hashlib.sha256()
+    upload.seek(0)
+    for chunk in iter(lambda: upload.read(chunk_size), b""):
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+def copy_upload(upload, path, chunk_size=CHUNK_SIZE):
+    """
+    Copy a file object to `path` in chunks, so at most one chunk is held in memory at a time.
+
+    The copy is written under a temporary name first, so a failed copy never looks complete.
+
+    Returns:
+        int: Number of bytes written
+    """
+    upload.seek(0)
+    with open(f"{path}.part", "wb") as file:
+        shutil.copyfileobj(upload, file, chunk_size)
+        size = file.tell()
+    upload.seek(0)
+    os.replace(f"{path}.part", path)
+    return size
+
+def touch(path):
+    """Mark a file as just used, for least-recently-used eviction."""
+    if os.path.exists(path):
+        os.utime(path)
+
+def directory_usage(path):
+    """Return (total size in bytes, last modification time) of the files in a directory tree."""
+    size, last_used = 0, os.path.getmtime(path)
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                # Replaced or removed by a running job while we looked
+                continue
+            size += stat.st_size
+            last_used = max(last_used, stat.st_mtime)
+    return size, last_used
+
+def enforce_quota(scratch_dir, evictable, quota=QUOTA_BYTES):
+    """
+    Delete evictable job directories, least recently used first, until the scratch directory fits its quota.
+
+    Args:
+        scratch_dir (str): Directory holding one subdirectory per job
+        evictable (set[str]): Names of the job directories that may be deleted (finished jobs)
+        quota (int): Maximum total size in bytes
+
+    Returns:
+        int: Number of bytes freed
+    """
+    if not os.path.isdir(scratch_dir):
+        return 0
+    usage = {}
+    for name in os.listdir(scratch_dir):
+        path = os.path.join(scratch_dir, name)
+        if os.path.isdir(path):
+            usage[name] = directory_usage(path)
+    total = sum(size for size, _ in usage.values())
+    freed = 0
+    for name in sorted((name for name in usage if name in evictable), key=lambda name: usage[name][1]):
+        if total <= quota:
+            break
+        shutil.rmtree(os.path.join(scratch_dir, name), ignore_errors=True)
+        total -= usage[name][0]
+        freed += usage[name][0]
+    if total > quota:
+        print(f"Scratch directory is {total / 1e6:.0f} MB, over its {quota / 1e6:.0f} MB quota, "
+              "with nothing left to evict")
+    return freed
+
+def sweep(scratch_dir, jobs):
+    """
+    Remove scratch files no job needs: directories of unknown jobs, partial files and leftover inputs.
+
+    Only call this while no job is running.
+
+    Args:
+        scratch_dir (str): Directory holding one subdirectory per job
+        jobs (dict): Job ID -> whether the job still needs its input, for every known job
+
+    Returns:
+        int: Number of files and directories removed
+    """
+    if not os.path.isdir(scratch_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(scratch_dir):
+        path = os.path.join(scratch_dir, name)
+        if name not in jobs or not os.path.isdir(path):
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.unlink(path)
+            removed += 1
+            continue
+        for file_name in os.listdir(path):
+            if ".part" in file_name or (file_name.startswith("input.") and not jobs[name]):
+                os.unlink(os.path.join(path, file_name))
+                removed += 1
+    return removed
@@ -0,0 +1,66 @@
+"""Tests for the incremental JSON array parser used for streamed box responses."""
+
+import json
+
+import pytest
+
+from json_stream import JsonArrayParser
+
+BOXES = [
+    {"box_2d": [620, 80, 760, 180], "label": "exposed electrical outlet"},
+    {"box_2d": [700, 300, 980, 420], "label": "dangling \"cord\", near [the] {bed}\\"},
+    {"box_2d": [400, 550, 640, 900], "label": "sharp table corner"},
+]
+
+def feed_all(parser, chunks):
+    """Feed chunks one by one and return every element the parser produced."""
+    elements = []
+    for chunk in chunks:
+        elements += parser.feed(chunk)
+    return elements
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 40, 10000])
+def test_chunk_boundaries_anywhere(chunk_size):
+    text = "```json\n" + json.dumps(BOXES, indent=2) + "\n```"
+    parser = JsonArrayParser()
+    elements = feed_all(parser, [text[pos:pos + chunk_size] for pos in range(0, len(text), chunk_size)])
+    assert elements == BOXES
+    assert parser.done
+    parser.close()
+
+def test_escapes_split_across_chunks():
+    # The backslash of an escaped quote ends one chunk and the quote starts the next
+    parser = JsonArrayParser()
+    elements = feed_all(parser, ['[{"label": "a \\', '"quoted\\', '" ], [\\\\', '"}', ', {"label": "b"}]'])
+    assert elements == [{"label": 'a "quoted" ], [\\'}, {"label": "b"}]
+
+def test_elements_returned_as_soon_as_complete():
+    parser = JsonArrayParser()
+    assert parser.feed('[{"label": "a"}') == []
+    assert parser.feed(', {"label"') == [{"label": "a"}]
+    assert parser.feed(': "b"}]') == [{"label": "b"}]
+
+def test_empty_array():
+    parser = JsonArrayParser()
+    assert feed_all(parser, ["[", " ", "]"]) == []
+    parser.close()
+
+def test_truncated_array_fails_on_close():
+    text = json.dumps(BOXES)
+    parser = JsonArrayParser()
+    elements = parser.feed(text[:-20])
+    assert elements == BOXES[:2]
+    with pytest.raises(json.JSONDecodeError):
+        parser.close()
+
+def test_missing_closing_bracket_fails_on_close():
+    parser = JsonArrayParser()
+    assert parser.feed('[{"label": "a"}, {"label": "b"}') == [{"label": "a"}]
+    with pytest.raises(json.JSONDecodeError):
+        parser.close()
+
+def test_no_array_fails_on_close():
+    parser = JsonArrayParser()
+    assert parser.feed("I could not find any hazards.") == []
+    with pytest.raises(json.JSONDecodeError):
+        parser.close()
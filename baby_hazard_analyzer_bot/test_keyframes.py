@@ -0,0 +1,63 @@
+"""Tests for scene-change keyframe selection."""
+
+import math
+import os
+
+import numpy as np
+
+from frame_extractor import iter_keyframes, open_video
+from keyframes import KeyframeSelector
+
+SAMPLE_VIDEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "house_video-1.mp4")
+
+def solid(color):
+    """Return a 64x64 BGR frame of a single color."""
+    frame = np.zeros((64, 64, 3), np.uint8)
+    frame[:] = color
+    return frame
+
+def select(selector, frames):
+    """Feed (index, frame) pairs through a selector and return the indices it keeps."""
+    return [idx for idx, frame in frames if selector.wants(idx) and selector.is_keyframe(idx, frame)]
+
+def test_sample_video_sends_no_more_frames_than_one_fps():
+    cap, fps, total_frames, _ = open_video(SAMPLE_VIDEO)
+    cap.release()
+    keyframes = [frame.index for frame in iter_keyframes(SAMPLE_VIDEO)]
+    assert 0 < len(keyframes) <= math.ceil(total_frames / fps)
+    # Still spread over the whole video
+    assert keyframes[0] == 0
+    assert total_frames - keyframes[-1] <= 2 * fps
+
+def test_static_video_keeps_a_frame_every_max_gap():
+    selector = KeyframeSelector(fps=30, max_gap_seconds=2.0, budget=0)
+    frame = solid((40, 80, 120))
+    assert select(selector, ((idx, frame) for idx in range(300))) == [0, 60, 120, 180, 240]
+
+def test_min_gap_skips_frames_without_decoding():
+    selector = KeyframeSelector(fps=30, min_gap_seconds=0.5, budget=0)
+    assert selector.wants(0)
+    selector.is_keyframe(0, solid((0, 0, 0)))
+    assert not selector.wants(14)
+    assert selector.wants(15)
+
+def test_new_view_is_kept_between_gaps():
+    selector = KeyframeSelector(fps=30, budget=0)
+    frames = [(idx, solid((200, 30, 30) if idx < 40 else (30, 200, 30))) for idx in range(0, 60, 5)]
+    assert select(selector, frames) == [0, 40]
+
+def test_budget_capped_by_duration():
+    assert KeyframeSelector(fps=30, total_frames=300, budget=60).budget == 10
+    assert KeyframeSelector(fps=30, total_frames=30 * 600, budget=60).budget == 60
+
+def test_budget_spread_over_the_whole_video():
+    # Every candidate is a new view: without pacing the budget would run out early
+    rng = np.random.default_rng(0)
+    total_frames = 30 * 120
+    selector = KeyframeSelector(fps=30, total_frames=total_frames, budget=20)
+    frames = ((idx, solid(rng.integers(0, 255, 3))) for idx in range(total_frames))
+    keyframes = select(selector, frames)
+    assert len(keyframes) <= 20
+    assert keyframes[-1] >= total_frames - selector.max_gap
+    # The minimum gap stays at its seconds-based value
+    assert selector.min_gap == 15
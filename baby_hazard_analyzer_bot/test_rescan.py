@@ -0,0 +1,68 @@
+"""Tests for matching a re-scan against the previous scan of a room."""
+
+import cv2
+import numpy as np
+
+from frames import Frame
+from rescan import Rescan, Scan, box_iou, frame_hash
+
+def room_view(seed):
+    """Return a smooth 320x240 BGR frame standing in for one view of a room."""
+    rng = np.random.default_rng(seed)
+    return cv2.resize(rng.integers(0, 255, (17, 16, 3)).astype(np.uint8), (320, 240), interpolation=cv2.INTER_CUBIC)
+
+def baseline_scan(views, boxes):
+    """Build a stored scan from frames and their boxes."""
+    hashes = np.array([frame_hash(Frame(pixels)) for pixels in views])
+    return Scan(1, "nursery", 0.0, (320, 240), hashes, boxes)
+
+def rescan_frames(baseline, frames_and_boxes):
+    """Look up and record new keyframes, analyzing changed ones with the given boxes."""
+    rescan = Rescan(baseline)
+    for index, (pixels, boxes) in enumerate(frames_and_boxes):
+        frame = Frame(pixels, index)
+        carried_over = rescan.lookup(frame)
+        rescan.record(frame, boxes if carried_over is None else carried_over)
+    return rescan
+
+OUTLET = {"box_2d": [20, 20, 60, 60], "label": "Exposed outlet near the sofa"}
+CORD = {"box_2d": [100, 200, 140, 300], "label": "Dangling blind cord"}
+
+def test_box_iou():
+    assert box_iou([0, 0, 10, 10], [0, 0, 10, 10]) == 1.0
+    assert box_iou([0, 0, 10, 10], [0, 5, 10, 15]) == 50 / 150
+    assert box_iou([0, 0, 10, 10], [20, 20, 30, 30]) == 0.0
+
+def test_unchanged_frame_is_carried_over():
+    view = room_view(1)
+    rescan = rescan_frames(baseline_scan([view], [[OUTLET]]), [(view, None)])
+    assert (rescan.carried_over, rescan.analyzed) == (1, 0)
+    assert rescan.hazard_diff() == {"new": [], "resolved": [], "unchanged": ["exposed outlet near the sofa"]}
+
+def test_changed_frame_matches_hazards_by_position():
+    view = room_view(1)
+    changed = view.copy()
+    changed[120:240, 0:200] = 255  # Something new in the lower left of the same view
+    toy = {"box_2d": [130, 10, 230, 190], "label": "Small toy on the rug"}
+    # The re-analyzed frame words the outlet differently and no longer sees the cord
+    reworded = {"box_2d": [22, 18, 62, 58], "label": "Uncovered electrical socket"}
+    rescan = rescan_frames(baseline_scan([view], [[OUTLET, CORD]]), [(changed, [reworded, toy])])
+    assert (rescan.carried_over, rescan.analyzed) == (0, 1)
+    assert rescan.hazard_diff() == {
+        "new": ["small toy on the rug"],
+        "resolved": ["dangling blind cord"],
+        "unchanged": ["uncovered electrical socket"],
+    }
+
+def test_unmatched_views_fall_back_to_labels():
+    rescan = rescan_frames(baseline_scan([room_view(1)], [[OUTLET, CORD]]),
+                           [(room_view(2), [{"box_2d": [0, 0, 10, 10], "label": "dangling blind cord "}])])
+    assert rescan.hazard_diff() == {
+        "new": [],
+        "resolved": ["exposed outlet near the sofa"],
+        "unchanged": ["dangling blind cord"],
+    }
+
+def test_first_scan_reports_everything_as_new():
+    rescan = rescan_frames(None, [(room_view(1), [OUTLET])])
+    assert rescan.hazard_diff() == {"new": ["exposed outlet near the sofa"], "resolved": [], "unchanged": []}
@@ -0,0 +1,55 @@
+"""Tests for timestamp parsing and merging of segmented video analysis results."""
+
+import pytest
+
+from video_analyzer import format_timestamp, merge_segment_results, parse_timestamp
+
+# Two 60 s segments cut with a 2 s overlap: the first covers 0-62 s, the second starts at 60 s
+SEGMENTS = [("segment000.mp4", 0.0, 60.0), ("segment001.mp4", 60.0, 120.0)]
+
+@pytest.mark.parametrize("value, seconds", [
+    ("00:05", 5.0),
+    ("1:02", 62.0),
+    ("01:01:01", 3661.0),
+    ("12.5", 12.5),
+    ("12s", 12.0),
+    (" 7 s ", 7.0),
+    (3, 3.0),
+    (4.5, 4.5),
+])
+def test_parse_timestamp(value, seconds):
+    assert parse_timestamp(value) == seconds
+
+@pytest.mark.parametrize("value", ["", "soon", "1:2:3:4", None, "-5"])
+def test_parse_timestamp_rejects_non_timestamps(value):
+    assert parse_timestamp(value) is None
+
+def test_format_timestamp():
+    assert format_timestamp(61.4) == "01:01"
+    assert format_timestamp(3661) == "01:01:01"
+
+def test_merge_shifts_and_orders_timestamps():
+    merged = merge_segment_results(
+        [[{"timestamp": "00:30", "label": "cord"}], [{"timestamp": "00:10", "label": "outlet"}]], SEGMENTS)
+    assert merged == [{"timestamp": "00:30", "label": "cord"}, {"timestamp": "01:10", "label": "outlet"}]
+
+def test_merge_drops_duplicates_in_the_overlap():
+    # The first segment sees the cord at 61 s (inside its overlap), the second at 60.5 s
+    merged = merge_segment_results(
+        [[{"timestamp": "01:01", "label": "Cord"}], [{"timestamp": "0.5", "label": " cord "}]], SEGMENTS)
+    assert merged == [{"timestamp": "01:01", "label": "Cord"}]
+
+def test_merge_keeps_different_labels_in_the_overlap():
+    merged = merge_segment_results(
+        [[{"timestamp": "01:01", "label": "cord"}], [{"timestamp": "00:01", "label": "outlet"}]], SEGMENTS)
+    assert [entry["label"] for entry in merged] == ["cord", "outlet"]
+
+def test_merge_keeps_same_label_after_the_overlap():
+    # A second cord well past the overlap is a different hazard
+    merged = merge_segment_results(
+        [[{"timestamp": "01:01", "label": "cord"}], [{"timestamp": "00:30", "label": "cord"}]], SEGMENTS)
+    assert [entry["timestamp"] for entry in merged] == ["01:01", "01:30"]
+
+def test_merge_skips_malformed_entries():
+    merged = merge_segment_results([["not a dict", {"label": "cord"}], []], SEGMENTS)
+    assert merged == [{"label": "cord", "timestamp": "00:00"}]
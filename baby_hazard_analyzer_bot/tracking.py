@@ -0,0 +1,150 @@
+"""
+Temporal box propagation between keyframes.
+Boxes detected on a keyframe are carried through the following frames with sparse
+Lucas-Kanade optical flow, so every frame of the output video is annotated while
+only keyframes are sent to the model. Track confidence decays with every frame so
+stale boxes drop out.
+"""
+
+import cv2
+import numpy as np
+
+from metrics import stage
+
+CONFIDENCE_DECAY = 0.98    # Per-frame confidence multiplier
+MIN_CONFIDENCE = 0.3       # Boxes below this confidence are dropped
+TRACKING_MAX_SIDE = 640    # Optical flow runs on frames downscaled to this long side
+MIN_POINTS = 3             # Tracks with fewer surviving feature points are dropped
+
+class BoxTracker:
+    """
+    Propagates a keyframe's boxes to the frames that follow it.
+
+    Call `reset()` with each keyframe and its detections, then `update()` with
+    every following frame. Frames are upright BGR arrays and boxes use the
+    "box_2d" [ymin, xmin, ymax, xmax] pixel convention.
+    """
+
+    def __init__(self, decay=CONFIDENCE_DECAY, min_confidence=MIN_CONFIDENCE, max_side=TRACKING_MAX_SIDE):
+        self.decay = decay
+        self.min_confidence = min_confidence
+        self.max_side = max_side
+        self._prev_gray = None
+        self._scale = 1.0
+        self._tracks = []  # dicts: box (full-res floats), points (small-frame coords), confidence, source box
+
+    def _gray(self, frame_bgr):
+        height, width = frame_bgr.shape[:2]
+        self._scale = min(1.0, self.max_side / max(height, width))
+        if self._scale < 1.0:
+            frame_bgr = cv2.resize(frame_bgr, (round(width * self._scale), round(height * self._scale)),
+                                   interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+
+    def reset(self, frame_bgr, boxes):
+        """Start new tracks from a keyframe's detections."""
+        self._prev_gray = self._gray(frame_bgr)
+        self._tracks = []
+        for box in boxes:
+            ymin, xmin, ymax, xmax = box['box_2d']
+            mask = np.zeros_like(self._prev_gray)
+            s = self._scale
+            mask[int(ymin * s):int(ymax * s) + 1, int(xmin * s):int(xmax * s) + 1] = 255
+            points = cv2.goodFeaturesToTrack(self._prev_gray, maxCorners=30, qualityLevel=0.01,
+                                             minDistance=3, mask=mask)
+            if points is not None and len(points) >= MIN_POINTS:
+                self._tracks.append({
+                    'box': np.array([ymin, xmin, ymax, xmax], dtype=np.float32),
+                    'points': points,
+                    'confidence': 1.0,
+                    'source': box,
+                })
+
+    def update(self, frame_bgr):
+        """
+        Move the tracked boxes onto the next frame.
+
+        Returns:
+            list[dict]: Tracked boxes with an added "confidence" in [0, 1]
+        """
+        gray = self._gray(frame_bgr)
+        if self._prev_gray is None or not self._tracks:
+            self._prev_gray = gray
+            return []
+
+        all_points = np.concatenate([track['points'] for track in self._tracks])
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, all_points, None,
+                                                        winSize=(21, 21), maxLevel=3)
+        self._prev_gray = gray
+
+        tracks, offset = [], 0
+        for track in self._tracks:
+            count = len(track['points'])
+            good = status[offset:offset + count, 0] == 1
+            old, new = track['points'][good], new_points[offset:offset + count][good]
+            offset += count
+            if len(new) < MIN_POINTS:
+                continue
+
+            # Translate by the median point motion and scale by the change in point spread
+            shift = np.median(new - old, axis=0)[0] / self._scale
+            old_spread = np.linalg.norm(old - old.mean(axis=0), axis=2).mean()
+            new_spread = np.linalg.norm(new - new.mean(axis=0), axis=2).mean()
+            zoom = float(np.clip(new_spread / old_spread, 0.8, 1.25)) if old_spread > 0 else 1.0
+
+            ymin, xmin, ymax, xmax = track['box']
+            cy, cx = (ymin + ymax) / 2 + shift[1], (xmin + xmax) / 2 + shift[0]
+            half_h, half_w = (ymax - ymin) / 2 * zoom, (xmax - xmin) / 2 * zoom
+            track['box'] = np.array([cy - half_h, cx - half_w, cy + half_h, cx + half_w], dtype=np.float32)
+            track['points'] = new.reshape(-1, 1, 2)
+            track['confidence'] *= self.decay * len(new) / count
+            if track['confidence'] >= self.min_confidence:
+                tracks.append(track)
+        self._tracks = tracks
+
+        height, width = frame_bgr.shape[:2]
+        limits = np.array([height, width, height, width])
+        return [
+            {
+                **track['source'],
+                'box_2d': [int(v) for v in np.clip(np.round(track['box']), 0, limits)],
+                'confidence': round(track['confidence'], 3),
+            }
+            for track in self._tracks
+        ]
+
+def propagate_boxes(all_frames, keyframe_results, tracker=None):
+    """
+    Merge keyframe detections into the full frame sequence.
+
+    Both inputs are consumed lazily and in order: every frame before the next
+    analyzed keyframe gets boxes tracked from the previous keyframe, and frames
+    are decoded one at a time, so nothing is buffered.
+
+    Args:
+        all_frames (Iterable[Frame]): Every frame of the video, in order
+        keyframe_results (Iterable[tuple]): (keyframe, boxes) pairs in frame order
+        tracker (BoxTracker): Tracker to use; a default one is created if omitted
+
+    Yields:
+        tuple: (upright Frame, boxes) for every frame of the video
+    """
+    tracker = tracker or BoxTracker()
+    all_frames = iter(all_frames)
+    for keyframe, boxes in keyframe_results:
+        for frame in all_frames:
+            if frame.index >= keyframe.index:
+                break
+            frame = frame.upright()
+            with stage("track"):
+                tracked = tracker.update(frame.pixels)
+            yield frame, tracked
+        keyframe = keyframe.upright()
+        with stage("track"):
+            tracker.reset(keyframe.pixels, boxes)
+        yield keyframe, boxes
+    for frame in all_frames:
+        frame = frame.upright()
+        with stage("track"):
+            tracked = tracker.update(frame.pixels)
+        yield frame, tracked
@@ -1,24 +1,104 @@
-from google import genai
-from google.genai import types
+from google.genai import errors, types
+import argparse
+import csv
+import json
 import os
-from dotenv import load_dotenv
+import re
+import subprocess
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+from image_analyzer import setup_client
+from file_registry import file_hash, get_file_registry
+from metrics import METRICS, stage
+from rate_limiter import call_with_retry
 
-def setup_client():
-    """Initialize and return the Gemini API client."""
-    # Load environment variables from .env file
-    load_dotenv()
-    
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise EnvironmentError("GEMINI_API_KEY environment variable not found. Please check your .env file.")
-    
-    return genai.Client(api_key=api_key)
+POLL_INITIAL_SECONDS = 0.25  # First wait while an upload is processing, doubled after every poll
+POLL_MAX_SECONDS = 5.0
+PROCESSING_TIMEOUT_SECONDS = 10 * 60
+
+SEGMENT_SECONDS = 60          # Target length of each segment in segmented mode
+SEGMENT_OVERLAP_SECONDS = 2   # Each segment also covers this much of the next one
+MAX_PARALLEL_SEGMENTS = 4     # Segments uploaded and analyzed at the same time
+
+SYSTEM_INSTRUCTION = "You are helping parents identify potential hazards in a room where young children (under 5 years old) may play."
+VIDEO_CONFIG = types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION)
+# Segment responses are parsed and merged, so ask for JSON outright
+SEGMENT_CONFIG = VIDEO_CONFIG.model_copy(update={"response_mime_type": "application/json"})
+
+def wait_until_active(client, video_file):
+    """
+    Poll an uploaded file until the Files API has finished processing it.
+
+    Polls start at sub-second intervals and back off exponentially, so short
+    videos are picked up almost as soon as they are ready.
+
+    Args:
+        client (genai.Client): Gemini API client
+        video_file (File): The uploaded file
+
+    Returns:
+        File: The file, once active
+
+    Raises:
+        ValueError: If processing failed
+        TimeoutError: If processing did not finish within PROCESSING_TIMEOUT_SECONDS
+    """
+    delay = POLL_INITIAL_SECONDS
+    deadline = time.monotonic() + PROCESSING_TIMEOUT_SECONDS
+    while video_file.state.name == "PROCESSING":
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{video_file.name} still processing after {PROCESSING_TIMEOUT_SECONDS}s")
+        print('.', end='')
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_SECONDS)
+        video_file = client.files.get(name=video_file.name)
+
+    if video_file.state.name == "FAILED":
+        raise ValueError(video_file.state.name)
+    return video_file
+
+def upload_video(client, video_path):
+    """
+    Upload a video to the Files API, reusing an earlier upload of the same contents.
+
+    Args:
+        client (genai.Client): Gemini API client
+        video_path (str): Path to the video file
+
+    Returns:
+        File: The active uploaded file
+    """
+    registry = get_file_registry()
+    content_hash = file_hash(video_path)
+
+    name = registry.get(content_hash)
+    if name is not None:
+        try:
+            video_file = client.files.get(name=name)
+            if video_file.state.name != "FAILED":
+                print(f"Reusing uploaded file {name}")
+                return wait_until_active(client, video_file)
+        except errors.APIError:
+            pass
+        # Deleted, expired early or failed: upload again
+        registry.remove(content_hash)
+
+    with stage("file_upload"):
+        video_file = client.files.upload(file=video_path)
+    with stage("file_processing"):
+        video_file = wait_until_active(client, video_file)
+    if video_file.expiration_time:
+        registry.put(content_hash, video_file.name, video_file.expiration_time.timestamp())
+    return video_file
 
 def analyze_video_from_path(video_path, prompt_text, model_name="gemini-2.0-flash"):
     """
     Analyze an video using Google's Gemini model.
     
+    The uploaded video is kept (until the Files API expires it) and recorded in
+    the file registry, so analyzing the same video again skips the upload.
+
     Args:
         video_path (str): Path to the video file
         prompt_text (str): Text prompt to send with the video
@@ -31,38 +111,22 @@ def analyze_video_from_path(video_path, prompt_text, model_name="gemini-2.0-flas
         # Setup client
         client = setup_client()
         
-        # Open video
-        video_file = client.files.upload(file=video_path)
-
-        # Wait until the uploaded video is available
-        while video_file.state.name == "PROCESSING":
-            print('.', end='')
-            time.sleep(5)
-            video_file = client.files.get(name=video_file.name)
-
-        if video_file.state.name == "FAILED":
-            raise ValueError(video_file.state.name)
+        # Upload the video, or reuse an earlier upload of it
+        video_file = upload_video(client, video_path)
         
         print("Video file uploaded successfully. Starting analysis...")
                 
         # Generate content
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[video_file, prompt_text]
-        )
-        response = client.models.generate_content(
-            model=f"models/{model_name}",
-            contents=[
-                prompt_text,
-                video_file
-                ],
-            config=types.GenerateContentConfig(
-                system_instruction="You are helping parents identify potential hazards in a room where young children (under 5 years old) may play.",
-                ),
-            )
-
-        # delete video
-        client.files.delete(name=video_file.name)
+        with stage("model"):
+            response = call_with_retry(lambda: client.models.generate_content(
+                model=f"models/{model_name}",
+                contents=[
+                    prompt_text,
+                    video_file
+                    ],
+                config=VIDEO_CONFIG,
+                ))
+        METRICS.add_usage(response.usage_metadata)
         
         return response.text
     except FileNotFoundError:
@@ -70,6 +134,164 @@ def analyze_video_from_path(video_path, prompt_text, model_name="gemini-2.0-flas
     except Exception as e:
         return f"Error generating content: {str(e)}"
 
+def split_video(video_path, output_dir, segment_seconds=SEGMENT_SECONDS, overlap_seconds=SEGMENT_OVERLAP_SECONDS):
+    """
+    Split a video into time segments with ffmpeg stream copy (no re-encoding).
+
+    Only the video and (if any) audio tracks are copied: phone recordings often
+    carry data or timecode tracks that the segment muxer rejects.
+
+    Stream copy can only cut on keyframes, so ffmpeg's segment muxer first picks
+    keyframe-aligned boundaries and reports their exact times. With an overlap,
+    each segment is then cut again from its (keyframe) start to `overlap_seconds`
+    past the next boundary.
+
+    Args:
+        video_path (str): Path to the video file
+        output_dir (str): Directory for the segment files
+        segment_seconds (float): Target segment length
+        overlap_seconds (float): How far each segment extends into the next one
+
+    Returns:
+        list[tuple]: (segment path, start offset in seconds, end of the segment's own span) per segment, in order
+
+    Raises:
+        RuntimeError: If ffmpeg fails
+    """
+    extension = os.path.splitext(video_path)[1] or ".mp4"
+    list_path = os.path.join(output_dir, "segments.csv")
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error", "-i", video_path, "-map", "0:v", "-map", "0:a?", "-c", "copy",
+        "-f", "segment", "-segment_time", str(segment_seconds), "-reset_timestamps", "1",
+        "-segment_list", list_path, "-segment_list_type", "csv",
+        os.path.join(output_dir, f"segment%03d{extension}"),
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+    with open(list_path, newline="") as list_file:
+        segments = [(os.path.join(output_dir, name), float(start), float(end)) for name, start, end in csv.reader(list_file)]
+    if not overlap_seconds or len(segments) < 2:
+        return segments
+
+    for idx, (path, start, end) in enumerate(segments[:-1]):
+        # Seek just past the boundary so the input seek lands on the keyframe the boundary was cut at
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error", "-ss", f"{start + 0.001:.6f}", "-i", video_path,
+            "-t", f"{end - start + overlap_seconds:.6f}", "-map", "0:v", "-map", "0:a?", "-c", "copy",
+            "-avoid_negative_ts", "make_zero", path,
+        ]
+        result = subprocess.run(command, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return segments
+
+def parse_timestamp(value):
+    """
+    Convert a model timestamp ("MM:SS", "HH:MM:SS", "12.5", "12s" or a number) to seconds.
+
+    Returns:
+        float | None: Seconds, or None if the value isn't a timestamp
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"\s*(?:(\d+):)?(?:(\d+):)?(\d+(?:\.\d+)?)\s*s?\s*", str(value))
+    if not match:
+        return None
+    parts = [float(part) for part in match.groups() if part is not None]
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+def format_timestamp(seconds):
+    """Format seconds as "MM:SS" (or "HH:MM:SS" for long videos)."""
+    minutes, secs = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+def merge_segment_results(segment_results, segments, overlap_seconds=SEGMENT_OVERLAP_SECONDS):
+    """
+    Shift per-segment timestamps to the full video and merge them into one ordered list.
+
+    Where a segment overlaps the next one, a hazard the next segment reports with
+    the same label within `overlap_seconds` of the earlier report is dropped.
+
+    Args:
+        segment_results (list[list[dict]]): Parsed entries for each segment
+        segments (list[tuple]): (path, start offset, end) per segment, as returned by split_video
+        overlap_seconds (float): Overlap the segments were cut with
+
+    Returns:
+        list[dict]: Entries with "timestamp" relative to the full video, in time order
+    """
+    merged = []    # (seconds, segment index, normalized label, entry)
+    for idx, (entries, (_, offset, _)) in enumerate(zip(segment_results, segments)):
+        previous = [item for item in merged if item[1] == idx - 1]
+        overlap_end = segments[idx - 1][2] + overlap_seconds if idx else offset
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            seconds = offset + (parse_timestamp(entry.get("timestamp")) or 0.0)
+            label = str(entry.get("label", "")).strip().lower()
+            if seconds <= overlap_end and any(
+                other_label == label and abs(seconds - other_seconds) <= overlap_seconds
+                for other_seconds, _, other_label, _ in previous
+            ):
+                continue
+            merged.append((seconds, idx, label, {**entry, "timestamp": format_timestamp(seconds)}))
+    merged.sort(key=lambda item: item[0])
+    return [entry for _, _, _, entry in merged]
+
+def analyze_video_in_segments(video_path, prompt_text, model_name="gemini-2.0-flash", segment_seconds=SEGMENT_SECONDS,
+                              overlap_seconds=SEGMENT_OVERLAP_SECONDS, max_parallel=MAX_PARALLEL_SEGMENTS):
+    """
+    Analyze a long video by splitting it into segments that are uploaded and analyzed concurrently.
+
+    Args:
+        video_path (str): Path to the video file
+        prompt_text (str): Text prompt to send with each segment; should ask for a JSON list
+            with a "timestamp" and "label" per entry
+        model_name (str): Name of the Gemini model to use
+        segment_seconds (float): Target segment length
+        overlap_seconds (float): How far each segment extends into the next one
+        max_parallel (int): Maximum number of segments processed at the same time
+
+    Returns:
+        str: JSON list of the merged entries, with timestamps relative to the full video
+    """
+    try:
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(video_path)
+        client = setup_client()
+
+        with tempfile.TemporaryDirectory() as segment_dir:
+            segments = split_video(video_path, segment_dir, segment_seconds, overlap_seconds)
+            print(f"Split the video into {len(segments)} segments. Starting analysis...")
+
+            def analyze_segment(segment):
+                video_file = upload_video(client, segment[0])
+                with stage("model"):
+                    response = call_with_retry(lambda: client.models.generate_content(
+                        model=f"models/{model_name}",
+                        contents=[prompt_text, video_file],
+                        config=SEGMENT_CONFIG,
+                    ))
+                METRICS.add_usage(response.usage_metadata)
+                with stage("parse"):
+                    entries = json.loads(response.text)
+                return entries if isinstance(entries, list) else []
+
+            with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+                segment_results = list(executor.map(analyze_segment, segments))
+
+        return json.dumps(merge_segment_results(segment_results, segments, overlap_seconds), indent=2)
+    except FileNotFoundError:
+        return f"Error: Video file '{video_path}' not found."
+    except Exception as e:
+        return f"Error generating content: {str(e)}"
+
 def main():
     """Main function to run the video analysis."""
     video_path = "house_video-1.mp4"
@@ -89,7 +311,17 @@ def main():
 Output a json list where each entry contains the 2D bounding box in "box_2d", the timestamp from the video in "timestamp", and a text label in "label"."""
 # Only highlight meaningful dangers — do not flag normal items unless it is clearly risky. Return your findings as a short list, each with a location description."""
     
-    result = analyze_video_from_path(video_path, prompt)
+    parser = argparse.ArgumentParser(description="Find child safety hazards in a room video.")
+    parser.add_argument("video_path", nargs="?", default=video_path)
+    parser.add_argument("--segments", action="store_true",
+                        help="Split the video into segments analyzed in parallel (for long recordings)")
+    parser.add_argument("--segment-seconds", type=float, default=SEGMENT_SECONDS)
+    args = parser.parse_args()
+
+    if args.segments:
+        result = analyze_video_in_segments(args.video_path, prompt, segment_seconds=args.segment_seconds)
+    else:
+        result = analyze_video_from_path(args.video_path, prompt)
     print(result)
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+"""
+Single-pass H.264 encoding of annotated frames.
+Frames are streamed as raw RGB/BGR into one long-running ffmpeg process, so the
+video is encoded while frames are still being analyzed.
+"""
+
+import subprocess
+
+from metrics import stage
+
+class FfmpegWriter:
+    """
+    Encodes raw frames (RGB by default, or BGR with pix_fmt="bgr24") to an
+    H.264 MP4 through an ffmpeg subprocess.
+
+    The process is started on the first frame, once the frame size is known.
+    Use as a context manager, or call `close()` to finish the file.
+    """
+
+    def __init__(self, output_path, fps, pix_fmt="rgb24", crf=23, preset="veryfast"):
+        self.output_path = output_path
+        self.fps = fps
+        self.pix_fmt = pix_fmt
+        self.crf = crf
+        self.preset = preset
+        self.frames_written = 0
+        self._process = None
+        self._size = None
+
+    def _start(self, width, height):
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", self.pix_fmt, "-s", f"{width}x{height}", "-r", str(self.fps),
+            "-i", "-",
+            # libx264 with yuv420p needs even dimensions
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-c:v", "libx264", "-preset", self.preset, "-crf", str(self.crf),
+            "-pix_fmt", "yuv420p", "-movflags", "+faststart",
+            self.output_path,
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._size = (width, height)
+
+    def write(self, frame):
+        """
+        Encode one frame.
+
+        Args:
+            frame (np.ndarray): Frame of shape (height, width, 3) in `pix_fmt` channel order;
+                every frame must have the same size
+        """
+        height, width = frame.shape[:2]
+        if self._process is None:
+            self._start(width, height)
+        elif (width, height) != self._size:
+            raise ValueError(f"Frame size {width}x{height} does not match the video size {self._size[0]}x{self._size[1]}")
+        # Write straight from the array's buffer when it is already contiguous
+        with stage("encode"):
+            self._process.stdin.write(frame.data if frame.flags.c_contiguous else frame.tobytes())
+        self.frames_written += 1
+
+    def close(self):
+        """Flush the remaining frames and wait for ffmpeg to finish the file."""
+        if self._process is None:
+            return
+        with stage("encode"):
+            _, stderr = self._process.communicate()
+        process, self._process = self._process, None
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+            return False
+        self.close()
+        return False
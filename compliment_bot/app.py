@@ -1,6 +1,8 @@
+import hashlib
 import streamlit as st
 from PIL import Image
-from image_analyzer import analyze_image
+from image_analyzer import encode_image, normalize_image, stream_image_analysis, MODEL_NAME
+from response_cache import get_response_cache, make_key
 
 def setup_page():
     """Configure page settings and styling."""
@@ -86,13 +88,17 @@ def process_image(uploaded_file):
         return None, None
     
     try:
-        image = Image.open(uploaded_file)
+        # Upright and downscaled once, for both the preview and the request
+        image = normalize_image(Image.open(uploaded_file))
         st.image(image, caption="Your uploaded image", use_container_width=True)
         
-        # Session state helps prevent rerunning the API call on each interaction
-        if 'compliment' not in st.session_state:
+        # Session state helps prevent rerunning the API call on each interaction. The compliment
+        # is tied to the hash of the uploaded bytes, so a new photo never shows the old compliment
+        upload_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+        if st.session_state.get('compliment_upload') != upload_hash:
             # Don't generate compliment yet, wait for button click
             st.session_state.compliment = None
+            st.session_state.compliment_upload = upload_hash
             
         return image, st.session_state.compliment
         
@@ -101,13 +107,26 @@ def process_image(uploaded_file):
         return None, None
 
 def generate_compliment(image):
-    """Generate an AI compliment for the image."""
+    """Generate an AI compliment for the image, showing the words as they are generated."""
     try:
-        with st.spinner("AI is crafting your compliment..."):
-            prompt = "Give a kind and creative compliment about the person in this photo. Make sure to specify the colors in the outfit."
-            compliment = analyze_image(image, prompt)
-            st.session_state.compliment = compliment
-            return compliment
+        prompt = "Give a kind and creative compliment about the person in this photo. Make sure to specify the colors in the outfit."
+        # Reuse the compliment for a photo we've already seen
+        cache = get_response_cache()
+        key = make_key(image, prompt, None, MODEL_NAME)
+        compliment = cache.get(key)
+        if compliment is None:
+            # Stream into a placeholder; the finished compliment is shown in the result box
+            live_compliment = st.empty()
+            try:
+                with live_compliment.container():
+                    compliment = st.write_stream(stream_image_analysis(encode_image(image), prompt, MODEL_NAME))
+            finally:
+                # A stream that failed part way leaves no half-written compliment behind
+                live_compliment.empty()
+            # Only reached when the stream finished cleanly
+            cache.put(key, compliment)
+        st.session_state.compliment = compliment
+        return compliment
     except Exception as e:
         st.error(f"Error generating compliment: {e}")
         return None
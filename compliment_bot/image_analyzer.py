@@ -3,13 +3,29 @@ Image analysis using Google's Gemini API.
 This script takes an image and generates a creative description focusing on outfit colors.
 """
 
+import importlib.util
+import io
 import os
-from PIL import Image
+import streamlit as st
+from PIL import Image, ImageOps
 from google import genai
+from google.genai.types import HttpOptions, Part
 from dotenv import load_dotenv
 
+MODEL_NAME = "gemini-2.0-flash"
+# Longest side (in pixels) of the photo sent to the model, and its JPEG quality
+MAX_LONG_SIDE = int(os.getenv("COMPLIMENT_MAX_LONG_SIDE", "1024"))
+QUALITY = 85
+
+@st.cache_resource
 def setup_client():
-    """Initialize and return the Gemini API client."""
+    """
+    Initialize and return the process-wide Gemini API client.
+
+    The client is created once and shared across Streamlit reruns and threads,
+    so its HTTP connection pool (and the TLS sessions in it) are reused
+    between requests instead of being rebuilt for every call.
+    """
     # Load environment variables from .env file
     load_dotenv()
     
@@ -17,9 +33,63 @@ def setup_client():
     if not api_key:
         raise EnvironmentError("GEMINI_API_KEY environment variable not found. Please check your .env file.")
     
-    return genai.Client(api_key=api_key)
+    # Multiplex requests over HTTP/2 when the h2 package is available
+    client_args = {"http2": True} if importlib.util.find_spec("h2") else {}
+    return genai.Client(
+        api_key=api_key,
+        http_options=HttpOptions(client_args=client_args, async_client_args=client_args),
+    )
+
+def normalize_image(image, max_long_side=MAX_LONG_SIDE):
+    """
+    Rotate a photo upright according to its EXIF orientation and downscale it.
+
+    Args:
+        image (Image): The uploaded photo
+        max_long_side (int): Longest side of the result, in pixels
+
+    Returns:
+        Image: An upright RGB image no larger than max_long_side on either side
+    """
+    # Let the JPEG decoder skip detail we'd throw away (a 12 MP photo is decoded at 1/2 to 1/8 scale)
+    image.draft("RGB", (max_long_side, max_long_side))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((max_long_side, max_long_side), Image.LANCZOS)
+    return image
+
+def encode_image(image, quality=QUALITY):
+    """Re-encode a normalized image as a JPEG request part."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return Part.from_bytes(data=buffer.getvalue(), mime_type="image/jpeg")
+
+def stream_image_analysis(image, prompt_text, model_name=MODEL_NAME):
+    """
+    Analyze an image using Google's Gemini model, yielding the text as it is generated.
+
+    Args:
+        image (Image | Part): Image file, or an already encoded image part
+        prompt_text (str): Text prompt to send with the image
+        model_name (str): Name of the Gemini model to use
+
+    Yields:
+        str: Pieces of the response text
+
+    Raises:
+        Exception: If the request fails, possibly after part of the text was yielded
+    """
+    # Setup client
+    client = setup_client()
+
+    # Generate content, one chunk of text at a time
+    for chunk in client.models.generate_content_stream(
+        model=model_name,
+        contents=[image, prompt_text]
+    ):
+        if chunk.text:
+            yield chunk.text
 
-def analyze_image(image, prompt_text, model_name="gemini-2.0-flash"):
+def analyze_image(image, prompt_text, model_name=MODEL_NAME):
     """
     Analyze an image using Google's Gemini model.
     
@@ -45,7 +115,7 @@ def analyze_image(image, prompt_text, model_name="gemini-2.0-flash"):
     except Exception as e:
         return f"Error generating content: {str(e)}"
 
-def analyze_image_from_path(image_path, prompt_text, model_name="gemini-2.0-flash"):
+def analyze_image_from_path(image_path, prompt_text, model_name=MODEL_NAME):
     """
     Analyze an image using Google's Gemini model.
     
@@ -0,0 +1,125 @@
+"""
+Persistent cache of Gemini responses, stored in SQLite.
+Compliments are keyed by a hash of the photo's exact pixels combined with a hash of
+the prompt, the system instruction and the model name. A perceptual (grayscale)
+hash would be too loose here: the compliment names the outfit's colors, so the same
+pose in a different outfit must not get the same answer.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "responses.sqlite3"),
+)
+MAX_ENTRIES = 20000               # LRU eviction kicks in above this many entries
+TTL_SECONDS = 7 * 24 * 60 * 60    # Entries older than a week are treated as misses
+
+def image_hash(image):
+    """
+    Compute a SHA-256 of an image's mode, size and pixels.
+
+    Args:
+        image (Image): Image to hash, e.g. the normalized upload
+
+    Returns:
+        str: The hash as a hex string
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.width}x{image.height}:".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def make_key(image, prompt_text, system_instruction, model_name):
+    """Build the cache key for a request."""
+    request_hash = hashlib.sha256(
+        "\0".join([model_name, system_instruction or "", prompt_text]).encode("utf-8")
+    ).hexdigest()
+    return f"{image_hash(image)}:{request_hash}"
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with a size cap, LRU eviction and a TTL.
+
+    A single instance can be shared between threads.
+
+    Attributes:
+        hits (int): Number of lookups served from the cache in this process
+        misses (int): Number of lookups that missed (absent or expired) in this process
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Return the cached response for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        """Store a response, evicting the least recently used entries above the size cap."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and the number of stored entries."""
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+@st.cache_resource
+def get_response_cache():
+    """Return the process-wide response cache."""
+    return ResponseCache()